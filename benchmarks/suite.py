@@ -0,0 +1,199 @@
+"""
+Benchmark suite: microbenchmarks of the intersection and shading primitives
+and end-to-end renders of the demo scene of render.py, written as JSON.
+Runs headless, no image is shown or exported.
+
+	python -m benchmarks.suite -o results.json
+	python -m benchmarks.suite --quick
+	python -m benchmarks.suite --skip-micro --res 320x240 --rdepth 1 5 --processes 0 4 --args -batched -bvh
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+from os import cpu_count
+from time import perf_counter
+from timeit import repeat
+
+import numpy
+
+from raytracer.argumentHandler import ArgsHandler
+from raytracer.coloring import materialsContainer, red_mat
+from raytracer.lights import LightSet
+from raytracer.mesh import TriangleMesh
+from raytracer.shading import MaterialTable, normalized, phong
+from raytracer.objects import Color, HitPointData, Light, Plane, Ray, Sphere, Triangle, Vector
+from render import demoscene
+
+# the renders vary one setting at a time around the middle one
+RESOLUTIONS = ["80x60", "160x120", "320x240"]
+DEPTHS = [1, 3, 5]
+PROCESSES = [0, 2, 4]
+BASE = {"res": "160x120", "rdepth": 3, "processes": 0}
+
+
+def grid(n: int, size=40.0, z=100.0):
+	# n x n quads, two triangles each, facing the camera at the origin
+	ticks = numpy.linspace(-size, size, n + 1)
+	xs, ys = numpy.meshgrid(ticks, ticks, indexing="ij")
+	vertices = numpy.stack([xs.ravel(), ys.ravel(), numpy.full(xs.size, z)], axis=1)
+	corners = (numpy.arange(n)[:, None] * (n + 1) + numpy.arange(n)[None, :]).ravel()
+	faces = numpy.concatenate([
+		numpy.stack([corners, corners + n + 1, corners + 1], axis=1),
+		numpy.stack([corners + 1, corners + n + 1, corners + n + 2], axis=1),
+	])
+	return vertices, faces
+
+
+def primitives() -> dict:
+	# name -> (object, ray that hits it, ray that misses it)
+	origin = Vector(0, 0, 0)
+	hit, miss = Vector(.1, .05, 1), Vector(1, 1, -1)
+	return {
+		"Sphere": (Sphere(Vector(0, 0, 100), 30, red_mat), Ray(origin, hit), Ray(origin, miss)),
+		"Plane": (Plane(Vector(0, 0, 100), Vector(0, 0, -1), red_mat), Ray(origin, hit), Ray(origin, miss)),
+		"Triangle": (Triangle(Vector(-40, -40, 100), Vector(40, -40, 100), Vector(0, 40, 100), material=red_mat),
+					 Ray(origin, hit), Ray(origin, miss)),
+		"TriangleMesh": (TriangleMesh(*grid(64), material=red_mat), Ray(origin, hit), Ray(origin, miss)),
+	}
+
+
+def timeop(statement: str, namespace: dict, number: int, rounds=5) -> dict:
+	best = min(repeat(statement, globals=namespace, number=number, repeat=rounds))
+	return {"ops_per_s": number / best, "us_per_op": 1e6 * best / number, "number": number, "repeat": rounds}
+
+
+def micro(number: int) -> list:
+	results = []
+
+	def add(name, statement, namespace):
+		results.append(dict({"name": name}, **timeop(statement, namespace, number)))
+		print("{:<36}{:>14,.0f} op/s".format(name, results[-1]["ops_per_s"]), file=sys.stderr)
+
+	for name, (obj, hit, miss) in primitives().items():
+		namespace = {"obj": obj, "hit": hit, "miss": miss, "HitPointData": HitPointData}
+		add("{}.intersectionparameter hit".format(name), "obj.intersectionparameter(hit)", namespace)
+		add("{}.intersectionparameter miss".format(name), "obj.intersectionparameter(miss)", namespace)
+		namespace["dist"] = obj.intersectionparameter(hit)
+		add("HitPointData {}".format(name), "HitPointData(object=obj, ray=hit, distance=dist)", namespace)
+
+	p = Vector(13.5, -40, 71.25)
+	for name, material in (("Material", red_mat), ("CheckerBoard", materialsContainer[""])):
+		namespace = {"m": material, "p": p}
+		add("{}.calccolor".format(name), "m.calccolor(phi=.6, theta=.3, intensity=1.0, p=p)", namespace)
+		add("{}.calccolor shaded".format(name), "m.calccolor(p=p, shaded=True)", namespace)
+
+	# one lookup per point against one call for 1024 of them
+	checker = materialsContainer[""]
+	points = numpy.random.default_rng(0).uniform(-200, 200, (1024, 3))
+	add("CheckerBoard.getmat", "m.getmat(p)", {"m": checker, "p": p})
+	add("CheckerBoard.sample x1024", "m.sample(points)", {"m": checker, "points": points})
+
+	# the shading kernel on 1024 hits against calccolor on one
+	floor = Plane(Vector(0, -40, 0), Vector(0, 1, 0), checker)
+	table = MaterialTable([floor])
+	normals = numpy.broadcast_to(floor.normal.xyz, points.shape)
+	directions = normalized(points - numpy.array([0., 45., -75.]))
+	rows = table.rows(numpy.zeros(len(points), dtype=int), points)
+	add("phong x1024", "phong(table, rows, points, normals, directions, light, 1.0)",
+		{"phong": phong, "table": table, "rows": rows, "points": points, "normals": normals,
+		 "directions": directions, "light": numpy.array([50., 175., 20.])})
+
+	# light selection of 1024 hits among 256 lights with falloff, all that reach them against 4 drawn
+	rng = numpy.random.default_rng(1)
+	lights = [Light(Vector(*origin), Color(255, 255, 255), intensity=.6, falloff=10)
+			  for origin in rng.uniform(-200, 200, (256, 3)).tolist()]
+	for samples in (0, 4):
+		add("LightSet.draws x1024 samples {}".format(samples), "lightset.draws(points)",
+			{"lightset": LightSet(lights, cutoff=.05, samples=samples), "points": points})
+	return results
+
+
+def renders(configs: list, extra: list, rounds: int) -> list:
+	results = []
+	for config in configs:
+		argv = ["-res={}".format(config["res"].replace("x", ",")), "-rdepth={}".format(config["rdepth"]),
+				"-processes={}".format(config["processes"]), "-noshow"] + extra
+		times = []
+		for _ in range(rounds):
+			with redirect_stdout(StringIO()):
+				rt = demoscene(ArgsHandler(argv=argv))
+				start = perf_counter()
+				rt.start()
+				times.append(perf_counter() - start)
+
+		best = min(times)
+		result = dict(config, args=extra, seconds=best, times=times, pixels_per_s=rt.resW * rt.resH / best,
+					  reflections=rt.counters["shade"]["reflections"], shadowrays=rt.counters["shadow"]["rays"])
+		results.append(result)
+		print("render {} rdepth {} processes {} {}: {:.3f}s".format(
+				config["res"], config["rdepth"], config["processes"], " ".join(extra), best), file=sys.stderr)
+	return results
+
+
+def matrix(resolutions: list, depths: list, processes: list, base=BASE) -> list:
+	configs = [dict(base, res=res) for res in resolutions]
+	configs += [dict(base, rdepth=depth) for depth in depths]
+	configs += [dict(base, processes=count) for count in processes]
+
+	unique = []
+	for config in configs:
+		if config not in unique:
+			unique.append(config)
+	return unique
+
+
+def machine() -> dict:
+	try:
+		commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+	except OSError:
+		commit = ""
+	return {
+		"date": datetime.now().isoformat(timespec="seconds"),
+		"commit": commit or None,
+		"python": platform.python_version(),
+		"numpy": numpy.__version__,
+		"platform": platform.platform(),
+		"processor": platform.processor(),
+		"cpus": cpu_count(),
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(prog="python -m benchmarks.suite", description=__doc__.split("\n\n")[0].strip())
+	parser.add_argument("-o", "--output", help="write the JSON here instead of to stdout")
+	parser.add_argument("--quick", action="store_true", help="fewer iterations, renders at the first resolution only")
+	parser.add_argument("--skip-micro", action="store_true")
+	parser.add_argument("--skip-render", action="store_true")
+	parser.add_argument("--res", nargs="+", default=None, help="WxH resolutions, default {}".format(" ".join(RESOLUTIONS)))
+	parser.add_argument("--rdepth", nargs="+", type=int, default=DEPTHS)
+	parser.add_argument("--processes", nargs="+", type=int, default=PROCESSES)
+	parser.add_argument("--repeat", type=int, default=1, help="renders per setting, the best one counts")
+	parser.add_argument("--args", nargs=argparse.REMAINDER, default=[], help="further render.py flags, e.g. -batched -bvh")
+	options = parser.parse_args()
+
+	resolutions = options.res or RESOLUTIONS
+	results = {"machine": machine(), "micro": [], "render": []}
+	if not options.skip_micro:
+		results["micro"] = micro(2000 if options.quick else 20000)
+	if not options.skip_render:
+		if options.quick:
+			configs = matrix([], options.rdepth, options.processes, base=dict(BASE, res=resolutions[0]))
+		else:
+			configs = matrix(resolutions, options.rdepth, options.processes)
+		results["render"] = renders(configs, options.args, max(1, options.repeat))
+
+	text = json.dumps(results, indent=2)
+	if options.output:
+		with open(options.output, "w") as file:
+			file.write(text + "\n")
+	else:
+		print(text)
+
+
+if __name__ == '__main__':
+	main()
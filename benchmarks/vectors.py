@@ -0,0 +1,111 @@
+"""
+Microbenchmark of the slotted float Vector against the former ndarray backed one.
+
+	python -m benchmarks.vectors
+"""
+from timeit import repeat
+
+from numpy import add, array, cross, divide, dot, float64, multiply, ndarray, subtract
+from numpy.linalg import norm
+
+from raytracer.objects import Ray, Vector
+
+
+class ArrayVector:
+	# the Vector as it was before, wrapping a 3 element numpy.array
+
+	def __add__(self, other):
+		return ArrayVector(add(self.xyz, other.xyz))
+
+	def __sub__(self, other):
+		return ArrayVector(subtract(self.xyz, other.xyz))
+
+	def __mul__(self, other):
+		if isinstance(other, (float, float64, int)):
+			return ArrayVector(multiply(self.xyz, other))
+		return ArrayVector(multiply(self.xyz, other.xyz))
+
+	__rmul__ = __mul__
+
+	def __truediv__(self, other):
+		if isinstance(other, (float, float64, int)):
+			return ArrayVector(divide(self.xyz, other))
+		return ArrayVector(divide(self.xyz, other.xyz))
+
+	def __init__(self, x, y=0, z=0):
+		if isinstance(x, ArrayVector):
+			x, y, z = x.items()
+		elif type(x) in (tuple, list, array, ndarray):
+			x, y, z = x
+		self.xyz = array([x, y, z])
+
+	scale = __mul__
+
+	def items(self):
+		return self.xyz
+
+	def dot(self, other):
+		return dot(self.xyz, other.xyz)
+
+	def cross(self, other):
+		return ArrayVector(cross(self.xyz, other.xyz))
+
+	def length(self):
+		return norm(self.xyz)
+
+	def normalized(self):
+		return self / self.length()
+
+	def reflect(self, axis):
+		axis = axis.normalized()
+		return self - multiply(self.dot(axis), 2 * axis)
+
+	def vectorto(self, b):
+		return b - self
+
+
+class ArrayRay:
+
+	def __init__(self, origin, direction):
+		self.origin = origin
+		self.direction = direction.normalized()
+
+	def point_at(self, t):
+		return self.origin + self.direction * t
+
+
+OPERATIONS = [
+	("add", "a + b"),
+	("sub", "a - b"),
+	("scale", "a.scale(2.5)"),
+	("dot", "a.dot(b)"),
+	("cross", "a.cross(b)"),
+	("normalized", "a.normalized()"),
+	("reflect", "a.reflect(b)"),
+	("vectorto", "a.vectorto(b)"),
+	("ray", "R(a, b)"),
+	("point_at", "r.point_at(3.0)"),
+]
+
+
+def opspersecond(statement: str, namespace: dict, number=20000) -> float:
+	best = min(repeat(statement, globals=namespace, number=number, repeat=5))
+	return number / best
+
+
+def main():
+	classes = (("ndarray", ArrayVector, ArrayRay), ("slots", Vector, Ray))
+	namespaces = {}
+	for name, V, R in classes:
+		a, b = V(1.5, -2.0, 3.25), V(0.5, 4.0, -1.0)
+		namespaces[name] = {"a": a, "b": b, "R": R, "r": R(a, b)}
+
+	print("{:<12}{:>14}{:>14}{:>10}".format("op", "ndarray op/s", "slots op/s", "speedup"))
+	for op, statement in OPERATIONS:
+		old = opspersecond(statement, namespaces["ndarray"])
+		new = opspersecond(statement, namespaces["slots"])
+		print("{:<12}{:>14,.0f}{:>14,.0f}{:>9.1f}x".format(op, old, new, new / old))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,133 @@
+import json
+from bisect import bisect_right
+from math import cos, sin, tau
+
+from raytracer.objects import Camera, Light, Vector
+
+# what a frame may change, "object.attribute" for the keys of an animation file
+ANIMATED = ("camera.origin", "camera.focus", "camera.up", "camera.fov", "light.origin", "light.intensity")
+
+
+def linear(t: float) -> float:
+	return t
+
+
+def smoothstep(t: float) -> float:
+	return t * t * (3 - 2 * t)
+
+
+# module level functions, so an Animation pickles for the workers of -coordinator
+EASINGS = {"linear": linear, "smooth": smoothstep}
+
+
+class Track:
+	"""
+	Keyframes of one value, [(frame, value), ...] sorted by frame; a number or
+	a vector (tuple/list of three). Between two keys the value is interpolated,
+	before the first and after the last one it holds.
+	"""
+
+	# magic
+
+	def __init__(self, keys: list, ease="linear"):
+		if not keys:
+			raise ValueError("a track needs at least one key")
+		self.keys = sorted((int(frame), value) for frame, value in keys)
+		self.frames = [frame for frame, _ in self.keys]
+		self.ease = EASINGS[ease]
+
+	def __str__(self):
+		return "Track({} keys, {} - {})".format(len(self.keys), self.frames[0], self.frames[-1])
+
+	__repr__ = __str__
+
+	# behaviour
+
+	def at(self, frame: int):
+		i = bisect_right(self.frames, frame)
+		if i == 0:
+			return self.keys[0][1]
+		if i == len(self.keys):
+			return self.keys[-1][1]
+		(f0, v0), (f1, v1) = self.keys[i - 1], self.keys[i]
+		t = self.ease((frame - f0) / (f1 - f0))
+		if isinstance(v0, (int, float)):
+			return v0 + (v1 - v0) * t
+		return tuple(a + (b - a) * t for a, b in zip(v0, v1))
+
+
+class Animation:
+	"""
+	A numbered sequence of frames over one scene: tracks for the camera and
+	the light (see ANIMATED), everything else stays as the scene has it.
+	frame(n) gives the camera and the light of frame n; it only depends on
+	the animation, so worker processes work it out themselves from the
+	frame number that comes with each tile.
+	"""
+
+	# magic
+
+	def __init__(self, frames: int, camera: Camera, light: Light, tracks=None):
+		if frames < 1:
+			raise ValueError("an animation needs at least one frame")
+		self.frames = frames
+		self.tracks = tracks or {}
+		unknown = set(self.tracks) - set(ANIMATED)
+		if unknown:
+			raise ValueError("cannot animate {}, only {}".format(", ".join(sorted(unknown)), ", ".join(ANIMATED)))
+		# values of frame 0 of the scene, for everything without a track
+		self.base = {
+			"camera.origin": tuple(camera.origin), "camera.focus": tuple(camera.focus),
+			"camera.up": tuple(-1 * camera.up), "camera.fov": camera.fov,
+			"light.origin": tuple(Vector(light.origin)), "light.intensity": light.intensity,
+		}
+		self.color = light.color
+		self.falloff = light.falloff
+
+	def __str__(self):
+		return "Animation({} frames, {})".format(self.frames, ", ".join(sorted(self.tracks)) or "still")
+
+	__repr__ = __str__
+
+	def __len__(self):
+		return self.frames
+
+	# behaviour
+
+	def values(self, frame: int) -> dict:
+		return {name: self.tracks[name].at(frame) if name in self.tracks else value
+				for name, value in self.base.items()}
+
+	def frame(self, frame: int, res: tuple) -> tuple:
+		# (camera, light) of the frame
+		values = self.values(frame)
+		camera = Camera(Vector(values["camera.origin"]), Vector(values["camera.up"]), Vector(values["camera.focus"]),
+						values["camera.fov"], res=res)
+		light = Light(Vector(values["light.origin"]), self.color, intensity=values["light.intensity"],
+					  falloff=self.falloff)
+		return camera, light
+
+	@classmethod
+	def load(cls, fname: str, camera: Camera, light: Light, frames=None):
+		# {"frames": 48, "ease": "smooth", "camera": {"origin": [[0, [0, 45, -75]], [47, [60, 45, -60]]]},
+		#  "light": {"intensity": [[0, 1], [47, .2]]}}
+		with open(fname) as file:
+			content = json.load(file)
+		ease = content.get("ease", "linear")
+		tracks = {}
+		for kind in ("camera", "light"):
+			for attribute, keys in content.get(kind, {}).items():
+				tracks["{}.{}".format(kind, attribute)] = Track(keys, ease)
+		return cls(frames or content.get("frames", 1), camera, light, tracks)
+
+	@classmethod
+	def turntable(cls, frames: int, camera: Camera, light: Light):
+		# the camera once around the focus, at its height and distance, a key per frame
+		offset = camera.focus.vectorto(camera.origin)
+		keys = []
+		for frame in range(frames):
+			angle = tau * frame / frames
+			x = offset.x * cos(angle) - offset.z * sin(angle)
+			z = offset.x * sin(angle) + offset.z * cos(angle)
+			keys.append((frame, tuple(camera.focus + Vector(x, offset.y, z))))
+		return cls(frames, camera, light, {"camera.origin": Track(keys)})
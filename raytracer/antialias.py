@@ -0,0 +1,51 @@
+from numpy import abs, arange, int16, ndarray, repeat, tile, uint32, zeros
+
+# edge-adaptive supersampling: after one sample per pixel only the pixels on
+# color or object edges get a grid of extra, stratified subsamples
+
+
+def edgemask(data: ndarray, ids: ndarray, threshold: int) -> ndarray:
+	# (H, W) bool, set on both pixels of every horizontal or vertical neighbour pair
+	# whose colors differ by more than threshold in a channel or that show different objects
+	rgb = data.astype(int16)
+	mask = zeros(ids.shape, dtype=bool)
+
+	across = (abs(rgb[:, 1:] - rgb[:, :-1]).max(axis=2) > threshold) | (ids[:, 1:] != ids[:, :-1])
+	mask[:, 1:] |= across
+	mask[:, :-1] |= across
+
+	down = (abs(rgb[1:] - rgb[:-1]).max(axis=2) > threshold) | (ids[1:] != ids[:-1])
+	mask[1:] |= down
+	mask[:-1] |= down
+	return mask
+
+
+def gridsize(samples: int) -> int:
+	# side of the subsample grid, so that it plus the first sample stays within samples
+	side = 1
+	while (side + 1) ** 2 + 1 <= samples:
+		side += 1
+	return side
+
+
+def subsamples(xs: ndarray, ys: ndarray, side: int):
+	# side x side jittered subsample positions in each pixel, pixel by pixel;
+	# pixel x covers x - .5 to x + .5 like the ray of calcray goes through x
+	cells = side * side
+	cx = tile(arange(cells) % side, len(xs))
+	cy = tile(arange(cells) // side, len(xs))
+	px, py = repeat(xs, cells), repeat(ys, cells)
+
+	k = tile(arange(cells), len(xs))
+	sx = px + (cx + jitter(px, py, 2 * k)) / side - .5
+	sy = py + (cy + jitter(px, py, 2 * k + 1)) / side - .5
+	return sx, sy
+
+
+def jitter(xs: ndarray, ys: ndarray, k: ndarray) -> ndarray:
+	# reproducible [0, 1) offsets from an integer hash, independent of tiles and processes
+	h = (xs.astype(uint32) * uint32(73856093)) ^ (ys.astype(uint32) * uint32(19349663)) ^ (k.astype(uint32) * uint32(83492791))
+	h ^= h >> uint32(13)
+	h *= uint32(0x5bd1e995)
+	h ^= h >> uint32(15)
+	return (h & uint32(0xffff)) / 65536.
@@ -1,4 +1,5 @@
 import re
+from ast import literal_eval
 
 from raytracer.objects import Color, Material
 
@@ -78,16 +79,109 @@ class ArgsHandler:
 		try:
 			if int(ret) > max: return max
 		except ValueError:
-			if not eval(ret):
+			if not literal_eval(ret):
 				ret = 1
 		return int(ret)
 
+	def getTileSize(self) -> int:
+		ret = self._argvFormatted.get("tilesize", 16)
+		return max(1, int(ret))
+
+	def getProgressive(self) -> int:
+		# -progressive alone starts on every 8th pixel
+		ret = self._argvFormatted.get("progressive", 0)
+		if ret in ("", True):
+			return 8
+		return int(ret)
+
 	def isShow(self) -> bool:
 		return "noshow" in self._argvFormatted.keys()
 
 	def isExport(self) -> bool:
 		return "export" in self._argvFormatted.keys()
 
+	def isBatched(self) -> bool:
+		return "batched" in self._argvFormatted.keys()
+
+	def isBVH(self) -> bool:
+		return "bvh" in self._argvFormatted.keys()
+
+	def isInstrumented(self) -> bool:
+		return "instrument" in self._argvFormatted.keys()
+
+	def isStreamed(self) -> bool:
+		return "stream" in self._argvFormatted.keys()
+
+	def getCheckpoint(self) -> str:
+		# -checkpoint alone keeps it in the output directory
+		ret = self._argvFormatted.get("checkpoint", None)
+		if ret in ("", True):
+			return "./renders/checkpoint.raw"
+		return ret
+
+	def isResumed(self) -> bool:
+		return "resume" in self._argvFormatted.keys()
+
+	def getCoordinator(self) -> str:
+		# HOST:PORT to listen on for workers, only this machine unless a HOST is given
+		ret = self._argvFormatted.get("coordinator", None)
+		if ret in ("", True):
+			return "127.0.0.1:7600"
+		return ret
+
+	def getLocalWorkers(self) -> int:
+		ret = self._argvFormatted.get("localworkers", 0)
+		return int(ret)
+
+	def getWorker(self) -> str:
+		# HOST:PORT of the coordinator to work for
+		ret = self._argvFormatted.get("worker", None)
+		if ret in ("", True):
+			return "127.0.0.1:7600"
+		return ret
+
+	def getServe(self) -> str:
+		# HOST:PORT for the render server to listen on
+		ret = self._argvFormatted.get("serve", None)
+		if ret in ("", True):
+			return "127.0.0.1:7700"
+		return ret
+
+	def getScene(self) -> str:
+		# JSON scene file instead of the demo scene
+		ret = self._argvFormatted.get("scene", None)
+		return ret or None
+
+	def getAnimation(self) -> str:
+		# keyframes file of an animation, "turntable" for the camera going once around
+		ret = self._argvFormatted.get("animate", None)
+		if ret in ("", True):
+			return "turntable"
+		return ret
+
+	def getFrames(self) -> int:
+		ret = self._argvFormatted.get("frames", None)
+		return max(1, int(ret)) if ret else None
+
+	def getRelight(self) -> str:
+		# G-buffer file to shade the frame from, made by the first render with it
+		ret = self._argvFormatted.get("relight", None)
+		if ret in ("", True):
+			return "./renders/gbuffer.npz"
+		return ret
+
+	def isAntialiased(self) -> bool:
+		return "aa" in self._argvFormatted.keys()
+
+	def getAAThreshold(self) -> int:
+		# largest channel difference (0 - 255) between neighbours that is not an edge
+		ret = self._argvFormatted.get("aathreshold", 24)
+		return int(ret)
+
+	def getAASamples(self) -> int:
+		ret = self._argvFormatted.get("aasamples", 5)
+		return max(2, int(ret))
+
 	def getReflection(self) -> float:
 		ret = self._argvFormatted.get("reflection", 0.3)
 		return float(ret)
@@ -96,24 +190,50 @@ class ArgsHandler:
 		ret = self._argvFormatted.get("rdepth", 3)
 		return int(ret)
 
+	def getReflectionThreshold(self) -> float:
+		ret = self._argvFormatted.get("rthreshold", 0)
+		return float(ret)
+
 	def getLightIntensity(self) -> float:
 		ret = self._argvFormatted.get("lightintensity", 1)
 		return float(ret)
 
+	def getLightCutoff(self) -> float:
+		# intensity below which a light with falloff no longer reaches a point
+		ret = self._argvFormatted.get("lightcutoff", .01)
+		return float(ret)
+
+	def getLightSamples(self) -> int:
+		# lights shaded per hit at most, drawn from those that reach it; 0 for all of them
+		ret = self._argvFormatted.get("lightsamples", 0)
+		return max(0, int(ret))
+
 	def getMulti(self) -> int:
 		ret = self._argvFormatted.get("multi", 4)
 		return int(ret)
 
+	def getToneMap(self) -> str:
+		ret = self._argvFormatted.get("tonemap", "clamp")
+		return ret
+
+	def getMesh(self) -> str:
+		ret = self._argvFormatted.get("mesh", None)
+		return ret
+
+	def getRenderLog(self) -> str:
+		ret = self._argvFormatted.get("renderlog", None)
+		return ret
+
 	def getLightPos(self) -> list:
 		ret = self._argvFormatted.get("lightpos", None)
 		if ret:
-			return eval(ret)
+			return list(literal_eval(ret))
 		return [50, 175, 20]
 
 	def getLightColor(self) -> Color:
 		ret = self._argvFormatted.get("lightcolor", None)
 		if ret:
-			return Color(eval(ret))
+			return Color(literal_eval(ret))
 		return Color(r=Color._MAX, g=Color._MAX, b=Color._MAX)
 
 	def getFloorMaterial(self) -> Material:
@@ -131,7 +251,7 @@ class ArgsHandler:
 		if ret:
 			ret_str = ret.replace(",", "\",\"").replace("\"\"", "\"\"").replace("(", "(\"").replace(")", "\")")
 
-			ret_lst = list(eval(ret_str))
+			ret_lst = list(literal_eval(ret_str))
 			for idx, colName in enumerate(ret_lst):
 				length = len(materialsContainer.keys())
 				random_idx = randint(0, length * randint(1, length)) % length
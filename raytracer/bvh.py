@@ -0,0 +1,299 @@
+from time import perf_counter
+
+from numpy import arange, array, errstate, full, inf, maximum, minimum, ndarray, where, zeros
+
+_PAD = 1e-7  # widens every box a little, so rounding never drops a hit on its surface
+_FAR = 1e30  # stands in for 1 / 0 in the slab test, keeps inf * 0 out of it
+
+
+class BVHNode:
+	__slots__ = ("lo", "hi", "left", "right", "objects")
+
+	def __init__(self, lo, hi, left=None, right=None, objects=None):
+		self.lo = lo  # (x, y, z) floats
+		self.hi = hi
+		self.left = left
+		self.right = right
+		self.objects = objects  # [(index, object), ...] in leaves, None otherwise
+
+
+class BVH:
+	"""
+	Bounding volume hierarchy over the bounded scene objects (spheres, triangles).
+	Objects without bounds (planes) are kept in a separate list and tested
+	against every ray. Hits are reported exactly as the linear search in
+	RayTracer.intersect would, ties go to the object listed first.
+	"""
+
+	# magic
+
+	def __init__(self, objects: list, leafsize=4):
+		start = perf_counter()
+
+		self.objects = objects
+		self.leafsize = leafsize
+		self.unbounded = []
+		bounded = []
+		for idx, obj in enumerate(objects):
+			bounds = obj.bounds()
+			if bounds is None:
+				self.unbounded.append((idx, obj))
+			else:
+				lo, hi = bounds
+				bounded.append((idx, obj, tuple(map(float, lo)), tuple(map(float, hi))))
+
+		self._nodes, self._leaves, self._depth = 0, 0, 0
+		self.root = self.build(bounded, 1) if bounded else None
+
+		self.stats = {
+			"build": perf_counter() - start,
+			"bounded": len(bounded),
+			"unbounded": len(self.unbounded),
+			"nodes": self._nodes,
+			"leaves": self._leaves,
+			"depth": self._depth,
+		}
+		self.counters = {"queries": 0, "nodes": 0, "tests": 0}
+
+	def __str__(self):
+		return "BVH({} bounded, {} unbounded)".format(self.stats["bounded"], self.stats["unbounded"])
+
+	__repr__ = __str__
+
+	# building
+
+	def build(self, items: list, depth: int) -> BVHNode:
+		self._nodes += 1
+		self._depth = max(self._depth, depth)
+
+		lo = tuple(min(item[2][a] for item in items) - _PAD for a in range(3))
+		hi = tuple(max(item[3][a] for item in items) + _PAD for a in range(3))
+
+		if len(items) <= self.leafsize:
+			return self.leaf(lo, hi, items)
+
+		centroids = [tuple((item[2][a] + item[3][a]) / 2 for a in range(3)) for item in items]
+		extent = [max(c[a] for c in centroids) - min(c[a] for c in centroids) for a in range(3)]
+		axis = extent.index(max(extent))
+		if extent[axis] <= 0:  # all centroids coincide, no split separates them
+			return self.leaf(lo, hi, items)
+
+		order = sorted(range(len(items)), key=lambda i: centroids[i][axis])
+		half = len(items) // 2
+		left = self.build([items[i] for i in order[:half]], depth + 1)
+		right = self.build([items[i] for i in order[half:]], depth + 1)
+		return BVHNode(lo, hi, left=left, right=right)
+
+	def leaf(self, lo, hi, items: list) -> BVHNode:
+		self._leaves += 1
+		return BVHNode(lo, hi, objects=[(idx, obj) for idx, obj, _, _ in items])
+
+	# queries
+
+	@staticmethod
+	def _ray(ray):
+		o = (float(ray.origin[0]), float(ray.origin[1]), float(ray.origin[2]))
+		d = (float(ray.direction[0]), float(ray.direction[1]), float(ray.direction[2]))
+		inv = tuple(1.0 / c if c else _FAR for c in d)
+		return o, inv
+
+	@staticmethod
+	def _slab(node: BVHNode, o, inv, tmin, tmax) -> bool:
+		for a in range(3):
+			t0 = (node.lo[a] - o[a]) * inv[a]
+			t1 = (node.hi[a] - o[a]) * inv[a]
+			if t0 > t1:
+				t0, t1 = t1, t0
+			if t0 > tmin: tmin = t0
+			if t1 < tmax: tmax = t1
+			if tmin > tmax:
+				return False
+		return True
+
+	def intersect(self, ray, mindist=.0):
+		# nearest hit beyond mindist; returns (object, distance) or (None, inf)
+		counters = self.counters
+		counters["queries"] += 1
+
+		maxdist, hitidx, hitobj = inf, -1, None
+		for idx, obj in self.unbounded:
+			counters["tests"] += 1
+			hitdist = obj.intersectionparameter(ray)
+			if hitdist and mindist < hitdist < maxdist:
+				maxdist, hitidx, hitobj = hitdist, idx, obj
+
+		if self.root is None:
+			return hitobj, maxdist
+
+		o, inv = self._ray(ray)
+		stack = [self.root]
+		while stack:
+			node = stack.pop()
+			counters["nodes"] += 1
+			if not self._slab(node, o, inv, mindist, maxdist):
+				continue
+
+			if node.objects is None:
+				stack.append(node.right)
+				stack.append(node.left)
+				continue
+
+			for idx, obj in node.objects:
+				counters["tests"] += 1
+				hitdist = obj.intersectionparameter(ray)
+				if not hitdist or hitdist <= mindist:
+					continue
+				if hitdist < maxdist or (hitdist == maxdist and idx < hitidx):
+					maxdist, hitidx, hitobj = hitdist, idx, obj
+
+		return hitobj, maxdist
+
+	def occluder(self, ray, mindist=.0, maxdist=inf, skip=None):
+		# first object found with mindist < distance < maxdist, ignoring skip; None if there is none
+		counters = self.counters
+		counters["queries"] += 1
+
+		for idx, obj in self.unbounded:
+			if obj is skip:
+				continue
+			counters["tests"] += 1
+			hitdist = obj.intersectionparameter(ray)
+			if hitdist and mindist < hitdist < maxdist:
+				return obj
+
+		if self.root is None:
+			return None
+
+		o, inv = self._ray(ray)
+		stack = [self.root]
+		while stack:
+			node = stack.pop()
+			counters["nodes"] += 1
+			if not self._slab(node, o, inv, mindist, maxdist):
+				continue
+
+			if node.objects is None:
+				stack.append(node.right)
+				stack.append(node.left)
+				continue
+
+			for idx, obj in node.objects:
+				if obj is skip:
+					continue
+				counters["tests"] += 1
+				hitdist = obj.intersectionparameter(ray)
+				if hitdist and mindist < hitdist < maxdist:
+					return obj
+		return None
+
+	def intersect_batch(self, origins: ndarray, directions: ndarray, mindist=.0):
+		# batched nearest hit; rays travel down the tree as index arrays
+		n = len(origins)
+		counters = self.counters
+		counters["queries"] += n
+
+		maxdist = full(n, inf)
+		indices = full(n, -1)
+
+		def test(idx, obj, rays):
+			counters["tests"] += len(rays)
+			hitdist = obj.intersectionparameters(origins[rays], directions[rays])
+			closer = (mindist < hitdist) & ((hitdist < maxdist[rays]) | ((hitdist == maxdist[rays]) & (idx < indices[rays])))
+			maxdist[rays[closer]] = hitdist[closer]
+			indices[rays[closer]] = idx
+
+		everything = arange(n)
+		for idx, obj in self.unbounded:
+			test(idx, obj, everything)
+
+		if self.root is None:
+			return maxdist, indices
+
+		with errstate(divide="ignore"):
+			inv = where(directions == 0, _FAR, 1.0 / directions)
+
+		stack = [(self.root, everything)]
+		while stack:
+			node, rays = stack.pop()
+			counters["nodes"] += len(rays)
+
+			t0 = (array(node.lo) - origins[rays]) * inv[rays]
+			t1 = (array(node.hi) - origins[rays]) * inv[rays]
+			enter = maximum(minimum(t0, t1).max(axis=1), mindist)
+			leave = minimum(maximum(t0, t1).min(axis=1), maxdist[rays])
+			rays = rays[enter <= leave]
+			if not len(rays):
+				continue
+
+			if node.objects is None:
+				stack.append((node.right, rays))
+				stack.append((node.left, rays))
+				continue
+
+			for idx, obj in node.objects:
+				test(idx, obj, rays)
+
+		return maxdist, indices
+
+	def occluded_batch(self, origins: ndarray, directions: ndarray, mindist: float, maxdists: ndarray,
+					   skip: ndarray) -> ndarray:
+		# batched occluder: (N,) bool, whether any object but the one of index skip lies
+		# between mindist and maxdist along the ray; a ray is done with its first such hit
+		n = len(origins)
+		counters = self.counters
+		counters["queries"] += n
+		occluded = zeros(n, dtype=bool)
+
+		def test(idx, obj, rays):
+			rays = rays[(skip[rays] != idx) & ~occluded[rays]]
+			counters["tests"] += len(rays)
+			hitdist = obj.intersectionparameters(origins[rays], directions[rays])
+			occluded[rays[(mindist < hitdist) & (hitdist < maxdists[rays])]] = True
+
+		everything = arange(n)
+		for idx, obj in self.unbounded:
+			test(idx, obj, everything)
+
+		if self.root is None:
+			return occluded
+
+		with errstate(divide="ignore"):
+			inv = where(directions == 0, _FAR, 1.0 / directions)
+
+		stack = [(self.root, everything[~occluded])]
+		while stack:
+			node, rays = stack.pop()
+			rays = rays[~occluded[rays]]
+			counters["nodes"] += len(rays)
+
+			t0 = (array(node.lo) - origins[rays]) * inv[rays]
+			t1 = (array(node.hi) - origins[rays]) * inv[rays]
+			enter = maximum(minimum(t0, t1).max(axis=1), mindist)
+			leave = minimum(maximum(t0, t1).min(axis=1), maxdists[rays])
+			rays = rays[enter <= leave]
+			if not len(rays):
+				continue
+
+			if node.objects is None:
+				stack.append((node.right, rays))
+				stack.append((node.left, rays))
+				continue
+
+			for idx, obj in node.objects:
+				test(idx, obj, rays)
+
+		return occluded
+
+	def report(self) -> str:
+		stats, counters = self.stats, self.counters
+		lines = [
+			"> bvh: {} objects ({} unbounded), {} nodes, {} leaves, depth {}, built in {:.3f}s".format(
+					stats["bounded"] + stats["unbounded"], stats["unbounded"],
+					stats["nodes"], stats["leaves"], stats["depth"], stats["build"]),
+		]
+		if counters["queries"]:
+			lines.append("> bvh: {} queries, {:.2f} nodes and {:.2f} tests per query".format(
+					counters["queries"],
+					counters["nodes"] / counters["queries"],
+					counters["tests"] / counters["queries"]))
+		return "\n".join(lines)
@@ -0,0 +1,53 @@
+import json
+from os import O_APPEND, O_CREAT, O_WRONLY, close, open as osopen, path, remove, write
+
+
+class Checkpoint:
+	"""
+	Sidecar of a file backed framebuffer: a JSON header naming the scene and
+	settings, then one line per finished piece of work (a tile of a pass, the
+	edge detection). Any process appends to it with O_APPEND right after its
+	pixels are in the mapped file, so a killed render loses at most the tiles
+	that were in flight. A resumed render leaves out everything listed.
+	"""
+
+	# magic
+
+	def __init__(self, fname: str, header: dict, resume=False):
+		self.fname = fname
+		self.header = header
+		self.done = set()
+		self.resumed = resume and path.isfile(fname)
+
+		if self.resumed:
+			with open(fname) as file:
+				lines = file.read().split("\n")
+			if json.loads(lines[0]) != json.loads(json.dumps(header)):
+				raise ValueError("{} belongs to another scene or other settings, it cannot be resumed".format(fname))
+			# the last line may be cut off if the render got killed while writing it
+			self.done = {line for line in lines[1:] if line.endswith(";")}
+		else:
+			with open(fname, "w") as file:
+				file.write(json.dumps(header, sort_keys=True) + "\n")
+
+	def __str__(self):
+		return "Checkpoint({}, {} done)".format(self.fname, len(self.done))
+
+	__repr__ = __str__
+
+	def __contains__(self, key: str):
+		return key + ";" in self.done
+
+	# behaviour
+
+	def mark(self, key: str):
+		# one write() of one short line, whole lines do not interleave between processes
+		fd = osopen(self.fname, O_WRONLY | O_APPEND | O_CREAT)
+		try:
+			write(fd, (key + ";\n").encode())
+		finally:
+			close(fd)
+
+	def remove(self):
+		if path.isfile(self.fname):
+			remove(self.fname)
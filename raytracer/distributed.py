@@ -0,0 +1,301 @@
+import pickle
+import socket
+from queue import Empty, Queue
+from struct import pack, unpack
+from threading import Condition, Lock, Thread
+from time import perf_counter, sleep
+
+from raytracer.framebuffer import Framebuffer
+from raytracer.instruments import mergecounters
+from raytracer.scheduler import maketiles
+
+# tiles over TCP: a coordinator hands out the tiles of a frame to worker processes on any
+# host and puts their pixels into its framebuffer. Messages are pickles with a length in
+# front, so coordinator and workers have to trust each other (a private network).
+
+
+def parseaddress(address: str, port=7600) -> tuple:
+	# "host:port", "host" or ":port"
+	host, _, number = address.rpartition(":") if ":" in address else (address, "", "")
+	return host or "127.0.0.1", int(number or port)
+
+
+def sendmessage(conn: socket.socket, message):
+	data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+	conn.sendall(pack(">Q", len(data)) + data)
+
+
+def recvmessage(conn: socket.socket):
+	size, = unpack(">Q", _recvexactly(conn, 8))
+	return pickle.loads(_recvexactly(conn, size))
+
+
+def _recvexactly(conn: socket.socket, size: int) -> bytes:
+	chunks = []
+	while size:
+		chunk = conn.recv(min(size, 1 << 20))
+		if not chunk:
+			raise EOFError("connection closed")
+		chunks.append(chunk)
+		size -= len(chunk)
+	return b"".join(chunks)
+
+
+class Coordinator:
+	"""
+	Stands in for the TileScheduler of a RayTracer, with workers connecting
+	over TCP instead of forked processes. Every worker gets the pickled scene
+	once, then one tile at a time together with the tile's current pixels, and
+	sends back the tile's pixels and its counters since the last tile. A tile
+	whose worker disconnects or stays silent for timeout seconds goes back
+	into the queue for the next worker, up to retries times, after that the
+	run() fails with a RuntimeError; workers may join and leave while a
+	frame renders. With setscene() one coordinator and its workers go on to
+	the next frame or scene, the workers stay up in between.
+	"""
+
+	# magic
+
+	def __init__(self, framebuffer=None, scene=None, address=("127.0.0.1", 7600), tilesize=16,
+				 timeout=300., mark=None, retries=3):
+		self.framebuffer = framebuffer
+		self.scene = scene  # pickled RayTracer settings
+		self.version = 0  # of the scene, workers get it again once it changes
+		self.address = address
+		self.tilesize = tilesize
+		self.timeout = timeout
+		self.retries = retries  # times a tile may go back into the queue
+		self.mark = mark  # mark(tile, args) once a tile's pixels are in the framebuffer
+		self.stats = {}
+		self.counters = {}
+		self._tasks = Queue()
+		self._lock = Lock()
+		self._finished = Condition(self._lock)
+		self._pending = 0
+		self._run = 0  # tasks and results of an earlier, failed run() are left out
+		self._lost = {}  # task -> times lost with its worker in this run()
+		self._failed = None
+		self._threads = []
+		self._server = None
+
+	def __str__(self):
+		return "Coordinator({}:{}, {})".format(self.address[0], self.address[1], self.tilesize)
+
+	__repr__ = __str__
+
+	# behaviour
+
+	def listen(self):
+		# binds the port (0 picks a free one), workers may connect from here on
+		self._server = socket.create_server(self.address)
+		self.address = self._server.getsockname()[:2]
+		return self
+
+	def start(self):
+		if self._server is None:
+			self.listen()
+		self.stats = {"total": {"tiles": 0, "retries": 0, "time": .0}}
+		self.counters = {}
+		self._workers = 0
+		Thread(target=self.accept, name="coordinator", daemon=True).start()
+		print("> coordinator waiting for workers on {}:{}".format(*self.address))
+		return self
+
+	def accept(self):
+		while True:
+			try:
+				conn, peer = self._server.accept()
+			except OSError:  # closed by stop()
+				return
+			thread = Thread(target=self.serve, args=(conn, peer), daemon=True)
+			self._threads.append(thread)
+			thread.start()
+
+	def serve(self, conn: socket.socket, peer):
+		conn.settimeout(self.timeout)
+		task, name, version = None, None, -1
+		try:
+			kind, name = recvmessage(conn)
+			name = "{}@{}:{}".format(name, *peer[:2])
+			with self._lock:
+				stat = self.stats[name] = {"tiles": 0, "busy": .0, "lost": 0}
+				self._workers += 1
+
+			while True:
+				task = self._tasks.get()
+				if task is None:
+					sendmessage(conn, ("stop",))
+					return
+
+				tile, args, run = task
+				if run != self._run:  # left over from a failed run()
+					task = None
+					continue
+				started = perf_counter()
+				if version != self.version:
+					version = self.version
+					sendmessage(conn, ("scene", self.scene))
+				sendmessage(conn, ("tile", tile, args, self.slices(tile)))
+				kind, planes, counters = recvmessage(conn)
+				self.store(tile, args, planes, counters, run)
+				task = None
+				with self._lock:
+					stat["tiles"] += 1
+					stat["busy"] += perf_counter() - started
+		except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+			pass
+		finally:
+			conn.close()
+			with self._lock:
+				self._workers -= name is not None
+			if task is not None:  # lost with its worker, someone else renders it
+				with self._lock:
+					self.stats["total"]["retries"] += 1
+					if name in self.stats:
+						self.stats[name]["lost"] += 1
+					current = task[2] == self._run
+					lost = self._lost[task] = self._lost.get(task, 0) + 1
+					if current and lost > self.retries:
+						self._failed = "tile {} was lost with {} workers, the render gives up".format(task[0], lost)
+						self._finished.notify_all()
+				if current and lost <= self.retries:
+					self._tasks.put(task)
+
+	def slices(self, tile: tuple) -> dict:
+		# the planes of the tile as they are now; refining and sparse passes build on them
+		x_start, y_start, x_end, y_end = tile
+		fb = self.framebuffer
+		planes = {"data": fb.data[y_start:y_end, x_start:x_end].copy()}
+		if fb.ids is not None:
+			planes["ids"] = fb.ids[y_start:y_end, x_start:x_end].copy()
+			planes["edges"] = fb.edges[y_start:y_end, x_start:x_end].copy()
+		return planes
+
+	def store(self, tile: tuple, args: tuple, planes: dict, counters: dict, run: int):
+		x_start, y_start, x_end, y_end = tile
+		with self._lock:
+			if run != self._run:
+				return
+			for name, plane in planes.items():
+				getattr(self.framebuffer, name)[y_start:y_end, x_start:x_end] = plane
+			mergecounters(self.counters, counters)
+			if self.mark:
+				self.mark(tile, args)
+			self._pending -= 1
+			self._finished.notify_all()
+
+	def setscene(self, framebuffer: Framebuffer, scene: bytes, mark=None):
+		# the next frame renders into framebuffer, with the workers rebuilding their tracer from
+		# scene if it differs from the last one; counters and totals start over
+		with self._lock:
+			self.framebuffer, self.mark = framebuffer, mark
+			if scene != self.scene:
+				self.scene = scene
+				self.version += 1
+			self.counters = {}
+			self.stats["total"] = {"tiles": 0, "retries": 0, "time": .0}
+		return self
+
+	@property
+	def workers(self) -> int:
+		return self._workers
+
+	def run(self, resW: int, resH: int, *args, scale=1, top=0, exclude=None):
+		# same as TileScheduler.run, returns when every tile is back
+		tiles = maketiles(resW, resH, self.tilesize * scale, top=top)
+		if exclude:
+			tiles = [tile for tile in tiles if not exclude(tile, args)]
+
+		start = perf_counter()
+		with self._lock:
+			self._run += 1
+			self._pending, self._lost, self._failed = len(tiles), {}, None
+			run = self._run
+		for tile in tiles:
+			self._tasks.put((tile, args, run))
+		with self._lock:
+			while self._pending and not self._failed:
+				self._finished.wait()
+			if self._failed:
+				self._run += 1  # whatever is still out of this run is dropped
+				self.drain()
+				raise RuntimeError(self._failed)
+			self.stats["total"]["tiles"] += len(tiles)
+			self.stats["total"]["time"] += perf_counter() - start
+
+	def drain(self):
+		# takes back the tasks no worker has started on yet
+		try:
+			while True:
+				self._tasks.get_nowait()
+		except Empty:
+			pass
+
+	def stop(self):
+		# stop signal to every connected worker
+		self._server.close()
+		alive = [thread for thread in self._threads if thread.is_alive()]
+		for _ in alive:
+			self._tasks.put(None)
+		for thread in alive:
+			thread.join(self.timeout)
+		self._threads = []
+
+	def report(self) -> str:
+		lines = []
+		for name, stat in self.stats.items():
+			if name == "total":
+				continue
+			lines.append("> {}: {} tiles, busy {:.3f}s, {} lost".format(name, stat["tiles"], stat["busy"], stat["lost"]))
+		total = self.stats.get("total")
+		if total:
+			lines.append("> {} tiles of {}px in {:.3f}s over {} workers, {} retried".format(
+					total["tiles"], self.tilesize, total["time"], len(self.stats) - 1, total["retries"]))
+		return "\n".join(lines)
+
+
+def work(address: tuple, build, name="worker", patience=30.):
+	# one worker: connects (retrying for patience seconds), builds a tracer from every new
+	# scene with build(settings) and renders its tiles until told to stop
+	deadline = perf_counter() + patience
+	while True:
+		try:
+			conn = socket.create_connection(address)
+			break
+		except OSError:
+			if perf_counter() > deadline:
+				raise
+			sleep(.2)
+
+	with conn:
+		sendmessage(conn, ("hello", name))
+		tracer = None
+		while True:
+			message = recvmessage(conn)
+			if message[0] == "stop":
+				return
+			if message[0] == "scene":
+				if tracer is not None:
+					tracer.release()
+				tracer = build(pickle.loads(message[1]))
+				tracer.framebuffer = Framebuffer(tracer.resW, tracer.resH, tonemap=tracer.tonemap, ids=tracer.antialias)
+				tracer.prepare()
+				continue
+
+			kind, tile, args, planes = message
+			x_start, y_start, x_end, y_end = tile
+			fb = tracer.framebuffer
+			for plane, values in planes.items():
+				getattr(fb, plane)[y_start:y_end, x_start:x_end] = values
+
+			tracer.compute_tile(tile, *args)
+			planes = {plane: getattr(fb, plane)[y_start:y_end, x_start:x_end] for plane in planes}
+			sendmessage(conn, ("tile", planes, tracer.collect()))
+			resetcounters(tracer.counters)
+
+
+def resetcounters(groups: dict):
+	# zeros in place, the instruments hold on to the dicts
+	for counters in groups.values():
+		for key in counters:
+			counters[key] = type(counters[key])()
@@ -0,0 +1,129 @@
+from multiprocessing.shared_memory import SharedMemory
+from os import path
+
+from numpy import bool_, dtype, float64, int32, memmap, ndarray, uint8, zeros
+from PIL import Image
+
+from raytracer.antialias import edgemask
+from raytracer.tonemap import clamp
+
+
+class Framebuffer:
+	"""
+	(H, W, 3) uint8 pixel buffer. With shared=True it lives in shared memory,
+	so forked worker processes write their pixels straight into it.
+	With ids=True it also keeps the index of the object seen by each pixel
+	(-1 for none) and a mask of the pixels on edges, for antialiasing.
+	With rows set it only holds a band of that many rows, pixel row y goes
+	to y % rows; streamed renders write out one band before the next.
+	With fname set all of it is a memory mapped file instead, which outlives
+	a killed render; resume=True takes up the pixels of an existing one.
+	"""
+
+	# magic
+
+	def __init__(self, resW: int, resH: int, shared=False, tonemap=clamp, ids=False, rows=None,
+				 fname=None, resume=False):
+		self.resW, self.resH = resW, resH
+		self.tonemap = tonemap
+		self.shared = shared
+		self.rows = min(rows or resH, resH)
+		self.shape = (self.rows, resW, 3)
+		self.fname = fname
+		self.resumed = False
+		self._shms = []
+		self._offset = 0
+
+		if fname:
+			pixels = self.rows * resW
+			size = _aligned(3 * pixels) + (_aligned(4 * pixels) + pixels if ids else 0)
+			self.resumed = resume and path.isfile(fname) and path.getsize(fname) == size
+			if not self.resumed:
+				with open(fname, "wb") as file:
+					file.truncate(size)  # zeros, sparse where the file system allows
+
+		self.data = self.plane(self.shape, uint8)
+		self.ids, self.edges = None, None
+		if ids:
+			self.ids = self.plane(self.shape[:2], int32)
+			if not self.resumed:
+				self.ids.fill(-1)
+			self.edges = self.plane(self.shape[:2], bool_)
+
+	def __str__(self):
+		return "Framebuffer({}, {}, shared={}, rows={})".format(self.resW, self.resH, self.shared, self.rows)
+
+	__repr__ = __str__
+
+	# behaviour
+
+	def plane(self, shape: tuple, kind) -> ndarray:
+		if self.fname:
+			# the next part of the file; MAP_SHARED, so forked workers write into it as well
+			plane = memmap(self.fname, dtype=kind, mode="r+", offset=self._offset, shape=shape)
+			self._offset += _aligned(plane.nbytes)
+			return plane
+		if not self.shared:
+			return zeros(shape, dtype=kind)
+		size = dtype(kind).itemsize
+		for length in shape:
+			size *= length
+		shm = SharedMemory(create=True, size=size)
+		self._shms.append(shm)
+		plane = ndarray(shape, dtype=kind, buffer=shm.buf)
+		plane.fill(0)
+		return plane
+
+	def putarrays(self, xs: ndarray, ys: ndarray, colors: ndarray, indices: ndarray):
+		# pixels at the (N,) coordinates: (N, 3) float radiance, which is tone mapped here, once
+		# per pixel, and (N,) indices of the objects seen
+		if self.rows < self.resH:
+			ys = ys % self.rows
+		self.data[ys, xs] = self.tonemap(colors)
+		if self.ids is not None:
+			self.ids[ys, xs] = indices
+
+	def clear(self):
+		# for the next frame
+		self.data.fill(0)
+		if self.ids is not None:
+			self.ids.fill(-1)
+			self.edges.fill(False)
+
+	def markedges(self, threshold: int) -> int:
+		# marks the pixels to supersample, returns how many there are
+		self.edges[:] = edgemask(self.data, self.ids, threshold)
+		return int(self.edges.sum())
+
+	def blend(self, xs: ndarray, ys: ndarray, samples: ndarray, first=None):
+		# averages the stored pixels with (N, K, 3) float radiance of K more samples each;
+		# every sample is tone mapped on its own, so bright highlights do not bleed over edges.
+		# first, (N, 3) radiance of the pixels traced again, stands in for the stored pixels,
+		# which makes blending the same pixels twice harmless
+		n, k = samples.shape[:2]
+		mapped = self.tonemap(samples.reshape(n * k, 3)).reshape(n, k, 3)
+		stored = self.data[ys, xs] if first is None else self.tonemap(first)
+		total = stored.astype(float64) + mapped.sum(axis=1)
+		self.data[ys, xs] = (total / (k + 1) + .5).astype(uint8)
+
+	def toimage(self) -> Image.Image:
+		return Image.fromarray(self.data)
+
+	def close(self):
+		if self.fname and self.data is not None:
+			for plane in (self.data, self.ids, self.edges):
+				if plane is not None:
+					plane.flush()
+			self.data, self.ids, self.edges = None, None, None
+		if not self._shms:
+			return
+		self.data, self.ids, self.edges = None, None, None  # the views have to go before the segments can be closed
+		for shm in self._shms:
+			shm.close()
+			shm.unlink()
+		self._shms = []
+
+
+def _aligned(size: int) -> int:
+	# planes start on 8 byte boundaries in a mapped file
+	return (size + 7) // 8 * 8
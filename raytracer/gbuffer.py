@@ -0,0 +1,78 @@
+from hashlib import sha1
+from os import makedirs, path, replace
+
+from numpy import ascontiguousarray, load, ndarray, savez
+
+from raytracer.objects import Vector
+
+VERSION = 2  # of the file layout, part of the key
+
+# arrays of every level of hits, see GBuffer
+FIELDS = ("parent", "index", "points", "normals", "directions", "pairhit", "pairlight", "pairoccluded")
+
+
+def geometrykey(camera, lights, objects: list, res: tuple, maxlevel: int) -> str:
+	# everything the hits depend on: the camera, which lights reach where (for the shadow rays, see
+	# LightSet.geometry) and the shapes of the objects, but not their materials or the intensity
+	# and color of lights without falloff
+	digest = sha1()
+	parts = [VERSION, tuple(res), maxlevel, camera.origin, camera.up, camera.focus, camera.fov] + lights.geometry()
+	for obj in objects:
+		parts.append(type(obj).__name__)
+		parts.extend(obj.items())
+	for part in parts:
+		if isinstance(part, ndarray):  # mesh vertices and faces
+			digest.update(ascontiguousarray(part).tobytes())
+		else:
+			digest.update(repr(tuple(part) if isinstance(part, Vector) else part).encode())
+	return digest.hexdigest()[:16]
+
+
+class GBuffer:
+	"""
+	The hits of a frame, one level per recursion depth: for every hit the
+	object index, the point, the normal and the direction of the ray that
+	got there, plus a (hit, light) pair per light that reaches a hit with
+	whether that light is occluded. parent is the pixel number of a primary
+	hit and, one level down, the hit of the level above whose reflected ray
+	it is. Nothing in it depends on materials, reflectivity or the intensity
+	of lights without falloff, so changing those only needs shading it again.
+	"""
+
+	# magic
+
+	def __init__(self, key: str, pixels: int, levels: list):
+		self.key = key
+		self.pixels = pixels
+		self.levels = levels  # [{field: ndarray}, ...], level 1 first
+
+	def __str__(self):
+		return "GBuffer({}, {} pixels, {} hits over {} levels)".format(
+				self.key, self.pixels, self.hits(), len(self.levels))
+
+	__repr__ = __str__
+
+	# behaviour
+
+	def hits(self) -> int:
+		return sum(len(level["index"]) for level in self.levels)
+
+	def save(self, fname: str):
+		makedirs(path.dirname(fname) or ".", exist_ok=True)
+		arrays = {"{}{}".format(field, number): level[field]
+				  for number, level in enumerate(self.levels) for field in FIELDS}
+		with open(fname + ".part", "wb") as file:
+			savez(file, key=self.key, pixels=self.pixels, levels=len(self.levels), **arrays)
+		replace(fname + ".part", fname)
+
+	@classmethod
+	def load(cls, fname: str, key: str):
+		# the G-buffer in fname if it was made for key, None otherwise
+		if not path.isfile(fname):
+			return None
+		with load(fname) as stored:
+			if str(stored["key"]) != key:
+				return None
+			levels = [{field: stored["{}{}".format(field, number)] for field in FIELDS}
+					  for number in range(int(stored["levels"]))]
+			return cls(key, int(stored["pixels"]), levels)
@@ -0,0 +1,113 @@
+import zlib
+from struct import pack
+
+from numpy import ndarray
+from PIL import Image
+
+# image files written row by row, top to bottom, so that a frame never has to be
+# in memory as a whole; the in-memory export goes through the same writers,
+# which makes streamed and in-memory files equal byte for byte
+
+
+class PPMWriter:
+	"""
+	Binary PPM (P6), the header and then the raw RGB rows. Same bytes as PIL writes.
+	"""
+
+	# magic
+
+	def __init__(self, fname: str, width: int, height: int):
+		self.fname = fname
+		self.width, self.height = width, height
+		self.written = 0
+		self._file = open(fname, "wb")
+		self._file.write(b"P6\n%d %d\n255\n" % (width, height))
+
+	def __str__(self):
+		return "PPMWriter({}, {}x{})".format(self.fname, self.width, self.height)
+
+	__repr__ = __str__
+
+	# behaviour
+
+	def writerows(self, rows: ndarray):
+		# (n, width, 3) uint8, the next n rows of the image
+		self._file.write(rows.tobytes())
+		self.written += len(rows)
+
+	def close(self):
+		if self.written != self.height:
+			raise ValueError("{} of {} rows written to {}".format(self.written, self.height, self.fname))
+		self._file.close()
+
+
+class PNGWriter(PPMWriter):
+	"""
+	8 bit RGB PNG without filtering, compressed on the fly; the compressed
+	stream goes out in IDAT chunks of at most chunksize bytes.
+	"""
+
+	_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+	def __init__(self, fname: str, width: int, height: int, level=6, chunksize=1 << 16):
+		self.fname = fname
+		self.width, self.height = width, height
+		self.written = 0
+		self.chunksize = chunksize
+		self._compressor = zlib.compressobj(level)
+		self._pending = []
+		self._size = 0
+		self._file = open(fname, "wb")
+		self._file.write(self._SIGNATURE)
+		self.chunk(b"IHDR", pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+	def __str__(self):
+		return "PNGWriter({}, {}x{})".format(self.fname, self.width, self.height)
+
+	__repr__ = __str__
+
+	def chunk(self, kind: bytes, data: bytes):
+		self._file.write(pack(">I", len(data)) + kind + data)
+		self._file.write(pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+	def feed(self, data: bytes):
+		if data:
+			self._pending.append(data)
+			self._size += len(data)
+		while self._size >= self.chunksize:
+			data = b"".join(self._pending)
+			self.chunk(b"IDAT", data[:self.chunksize])
+			self._pending, self._size = [data[self.chunksize:]], len(data) - self.chunksize
+
+	def writerows(self, rows: ndarray):
+		for row in rows:
+			self.feed(self._compressor.compress(b"\x00" + row.tobytes()))  # filter type 0 per scanline
+		self.written += len(rows)
+
+	def close(self):
+		self.feed(self._compressor.flush())
+		rest = b"".join(self._pending)
+		if rest:
+			self.chunk(b"IDAT", rest)
+		self.chunk(b"IEND", b"")
+		PPMWriter.close(self)
+
+
+WRITERS = {"ppm": PPMWriter, "png": PNGWriter}
+
+
+def writeimage(fname: str, data: ndarray, ftype: str):
+	# whole (H, W, 3) frame through the streaming writer of the format
+	writer = WRITERS[ftype](fname, data.shape[1], data.shape[0])
+	writer.writerows(data)
+	writer.close()
+
+
+def imageformat(ftype: str) -> str:
+	# PIL format name of a file type, which may be an extension (jpg, tif); ValueError if PIL cannot write it
+	extensions = Image.registered_extensions()
+	name = extensions.get("." + ftype.lower(), ftype.upper())
+	if name not in Image.SAVE:
+		raise ValueError("cannot write images of type {}, one of {}".format(
+				ftype, ", ".join(sorted(ext[1:] for ext, fmt in extensions.items() if fmt in Image.SAVE))))
+	return name
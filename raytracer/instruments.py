@@ -0,0 +1,164 @@
+from time import perf_counter
+
+from raytracer.objects import isTexture
+
+
+def mergecounters(into: dict, groups: dict):
+	# {group: {name: count}} summed into into, counts and seconds alike
+	for group, counters in groups.items():
+		merged = into.setdefault(group, {})
+		for key, count in counters.items():
+			merged[key] = merged.get(key, 0) + count
+	return into
+
+
+class Instruments:
+	"""
+	Optional counters and timers on the hot path of a RayTracer: rays by kind,
+	intersection tests by primitive type, hits per recursion level and the
+	seconds spent intersecting, in shadow tests, shading and texture lookups.
+
+	attach() puts counting wrappers on the tracer, its objects and textures as
+	instance attributes, so that a render without instruments runs the plain
+	methods and pays nothing for them. Everything goes into tracer.counters,
+	which the tile scheduler sums up across the worker processes.
+	"""
+
+	# magic
+
+	def __init__(self, tracer):
+		self.tracer = tracer
+		self._wrapped = []
+
+	def __str__(self):
+		return "Instruments({} methods)".format(len(self._wrapped))
+
+	__repr__ = __str__
+
+	# behaviour
+
+	def attach(self):
+		counters = self.tracer.counters
+		rays = counters.setdefault("rays", {"primary": 0, "reflection": 0, "shadow": 0})
+		tests = counters.setdefault("tests", {})
+		depth = counters.setdefault("depth", {})
+		seconds = counters.setdefault("time", {})
+
+		def stage(owner, name: str, key: str, kind=None):
+			# times the method, counts a ray of kind per call
+			method = getattr(owner, name)
+			seconds.setdefault(key, .0)
+
+			def timed(*args, **kwargs):
+				start = perf_counter()
+				result = method(*args, **kwargs)
+				seconds[key] += perf_counter() - start
+				if kind:
+					rays[kind] += 1
+				return result
+			self.wrap(owner, name, timed)
+
+		tracer = self.tracer
+		intersect, intersect_batch = tracer.intersect, tracer.intersect_batch
+		seconds.setdefault("primary", .0)
+		seconds.setdefault("reflection", .0)
+
+		def counted_intersect(level, ray):
+			kind = "primary" if level == 1 else "reflection"
+			start = perf_counter()
+			hpd = intersect(level, ray)
+			seconds[kind] += perf_counter() - start
+			rays[kind] += 1
+			if hpd:
+				depth[level] = depth.get(level, 0) + 1
+			return hpd
+
+		def counted_intersect_batch(origins, directions, level=1):
+			kind = "primary" if level == 1 else "reflection"
+			start = perf_counter()
+			distances, indices = intersect_batch(origins, directions, level)
+			seconds[kind] += perf_counter() - start
+			rays[kind] += len(origins)
+			depth[level] = depth.get(level, 0) + int((indices >= 0).sum())
+			return distances, indices
+
+		occluded_batch, shade_batch = tracer.occluded_batch, tracer.shade_batch
+		seconds.setdefault("shadow", .0)
+		seconds.setdefault("shading", .0)
+
+		def counted_occluded_batch(points, indices, lights):
+			start = perf_counter()
+			occluded = occluded_batch(points, indices, lights)
+			seconds["shadow"] += perf_counter() - start
+			rays["shadow"] += len(points)
+			return occluded
+
+		def timed_shade_batch(level, origins, directions, distances, indices):
+			# without the time of the deeper levels, their intersections and shadow rays
+			start, before = perf_counter(), sum(seconds.values())
+			colors = shade_batch(level, origins, directions, distances, indices)
+			seconds["shading"] += perf_counter() - start - (sum(seconds.values()) - before)
+			return colors
+
+		self.wrap(tracer, "intersect", counted_intersect)
+		self.wrap(tracer, "intersect_batch", counted_intersect_batch)
+		self.wrap(tracer, "occluded_batch", counted_occluded_batch)
+		self.wrap(tracer, "shade_batch", timed_shade_batch)
+		stage(tracer, "objectbetween", "shadow", kind="shadow")
+		stage(tracer, "com_directlight", "shading")
+		stage(tracer, "com_shadedcolor", "shading")
+
+		textures = []
+		for obj in tracer.objects:
+			kind = type(obj).__name__
+			tests.setdefault(kind, 0)
+			self.count(obj, "intersectionparameter", tests, kind, lambda *args: 1)
+			self.count(obj, "intersectionparameters", tests, kind, lambda origins, directions: len(origins))
+
+			material = getattr(obj, "material", None)
+			if isinstance(material, isTexture) and not any(material is t for t in textures):
+				textures.append(material)
+				stage(material, "calccolor", "texture")  # already part of shading
+		return self
+
+	def count(self, owner, name: str, counters: dict, key: str, amount):
+		method = getattr(owner, name, None)
+		if method is None:
+			return
+
+		def counted(*args):
+			counters[key] += amount(*args)
+			return method(*args)
+		self.wrap(owner, name, counted)
+
+	def wrap(self, owner, name: str, wrapper):
+		setattr(owner, name, wrapper)
+		self._wrapped.append((owner, name))
+
+	def detach(self):
+		# back to the plain methods of the classes
+		for owner, name in reversed(self._wrapped):
+			if name in vars(owner):
+				delattr(owner, name)
+		self._wrapped = []
+
+	@staticmethod
+	def report(counters: dict) -> str:
+		lines = []
+		rays = counters.get("rays")
+		if rays:
+			lines.append("> rays: " + ", ".join("{} {}".format(count, kind) for kind, count in rays.items()))
+		tests = counters.get("tests")
+		if tests:
+			lines.append("> intersection tests: " + ", ".join(
+					"{} {}".format(count, kind) for kind, count in sorted(tests.items())))
+		depth = counters.get("depth")
+		if depth:
+			lines.append("> hits per depth: {}, deepest {}".format(
+					", ".join("{}: {}".format(level, depth[level]) for level in sorted(depth)), max(depth)))
+		seconds = counters.get("time")
+		if seconds:
+			lines.append("> time in: " + ", ".join(
+					"{} {:.3f}s".format(stage, spent) for stage, spent in seconds.items()) +
+						 " (summed over processes, texture is part of shading)")
+		return "\n".join(lines)
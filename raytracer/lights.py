@@ -0,0 +1,259 @@
+from bisect import bisect_right
+from math import floor, inf, sqrt
+from struct import pack, unpack
+
+from numpy import (arange, argsort, array, ascontiguousarray, concatenate, cumsum, float64, int64, maximum, median,
+				   minimum, ndarray, ones, repeat, searchsorted, split, tile, uint64, unique, zeros)
+from numpy import floor as floors
+
+from raytracer.objects import rowdot
+
+# many point lights: which of them reach a hit (culling) and, with samples, which few of
+# those it is shaded with (sampling). Both are worked out the same way for one hit and for
+# a batch of them, so the scalar and the batched path pick the same lights.
+
+_MAXCELLS = 512  # a light reaching over more grid cells than this is tested everywhere instead
+_M1, _M2 = uint64(0xbf58476d1ce4e5b9), uint64(0x94d049bb133111eb)  # splitmix64
+_GOLDEN = 0x9e3779b97f4a7c15
+_MASK = 0xffffffffffffffff
+
+
+def _mix(h: ndarray) -> ndarray:
+	h = (h ^ (h >> uint64(30))) * _M1
+	h = (h ^ (h >> uint64(27))) * _M2
+	return h ^ (h >> uint64(31))
+
+
+def uniforms(points: ndarray, count: int) -> ndarray:
+	# (N, count) numbers in [0, 1) that only depend on the bits of the (N, 3) points, so
+	# every process and both paths draw the same ones for the same hit
+	bits = ascontiguousarray(points, dtype=float64).view(uint64)
+	seed = _mix(_mix(_mix(bits[:, 0]) ^ bits[:, 1]) ^ bits[:, 2])
+	draws = zeros((len(points), count))
+	for j in range(count):
+		step = uint64((j + 1) * _GOLDEN & _MASK)
+		draws[:, j] = (_mix(seed + step) >> uint64(11)).astype(float64) * (1.0 / 2 ** 53)
+	return draws
+
+
+def _mixint(h: int) -> int:
+	h = (h ^ (h >> 30)) * 0xbf58476d1ce4e5b9 & _MASK
+	h = (h ^ (h >> 27)) * 0x94d049bb133111eb & _MASK
+	return h ^ (h >> 31)
+
+
+def uniformsat(point, count: int) -> list:
+	# uniforms() of one point (a Vector) in python ints, the same numbers without NumPy
+	x, y, z = unpack("<3Q", pack("<3d", point.x, point.y, point.z))
+	seed = _mixint(_mixint(_mixint(x) ^ y) ^ z)
+	return [(_mixint(seed + (j + 1) * _GOLDEN & _MASK) >> 11) * (1.0 / 2 ** 53) for j in range(count)]
+
+
+class LightSet:
+	"""
+	The lights of a scene packed into arrays: origins (L, 3), intensities and
+	falloff distances (L,), 0 for a light that does not fall off. Past a
+	falloff f the intensity drops as I / (1 + (d / f)^2); where that is below
+	cutoff the light gets neither a shadow ray nor shading. A uniform grid
+	over the spheres of influence hands every hit only the lights near it,
+	lights without falloff reach everywhere.
+
+	With samples, a hit in a cell of more lights is shaded with that many of
+	them, drawn in proportion to the most each gives anywhere in the cell
+	and weighted by the inverse of that probability. Drawing takes a binary
+	search in the cell's running sum, so the cost per hit stays at samples
+	shadow rays and shadings however many lights there are.
+	"""
+
+	# magic
+
+	def __init__(self, lights: list, cutoff=.01, samples=0):
+		if not lights:
+			raise ValueError("a scene needs at least one light")
+		self.lights = list(lights)
+		self.cutoff = cutoff
+		self.samples = samples
+		self.origins = array([light.origin.xyz for light in self.lights], dtype=float64)
+		self.intensities = array([light.intensity for light in self.lights], dtype=float64)
+		self.falloffs = array([light.falloff or 0 for light in self.lights], dtype=float64)
+		self.total = sum(self.intensities.tolist())  # the share of a light in the shadowed color
+
+		# python copies for near(), one hit at a time
+		self._origins = self.origins.tolist()
+		self._intensities = self.intensities.tolist()
+		self._falloffs = self.falloffs.tolist()
+
+		radii = []
+		for light in self.lights:
+			if not light.falloff:
+				radii.append(inf)
+			elif light.intensity > cutoff:
+				radii.append(light.falloff * sqrt(light.intensity / cutoff - 1))
+			else:
+				radii.append(-1.)  # never bright enough
+		self.radii = array(radii)
+
+		reaching = [idx for idx, radius in enumerate(radii) if 0 <= radius < inf]
+		self.cellsize = 2 * float(median(self.radii[reaching])) if reaching else 1.
+		always = [idx for idx, radius in enumerate(radii) if radius == inf]
+		cells = {}
+		for idx in reaching:
+			lo = [floor((c - radii[idx]) / self.cellsize) for c in self._origins[idx]]
+			hi = [floor((c + radii[idx]) / self.cellsize) for c in self._origins[idx]]
+			if (hi[0] - lo[0] + 1) * (hi[1] - lo[1] + 1) * (hi[2] - lo[2] + 1) > _MAXCELLS:
+				always.append(idx)
+				continue
+			for i in range(lo[0], hi[0] + 1):
+				for j in range(lo[1], hi[1] + 1):
+					for k in range(lo[2], hi[2] + 1):
+						cells.setdefault((i, j, k), []).append(idx)
+
+		self._always = sorted(always)
+		self._cells = {key: sorted(self._always + found) for key, found in cells.items()}
+		self.always = array(self._always, dtype=int64)
+		self.cells = {key: array(found, dtype=int64) for key, found in self._cells.items()}
+		self.widest = max([len(self._always)] + [len(found) for found in self._cells.values()]) or 1
+		self._importance = {}  # cell -> importance(), made when first needed
+		self._drawing = {}  # the same as python lists, for draw()
+		self._everywhere = None  # draw() for every point, if all lights reach everywhere
+		if not self._cells and all(not self._falloffs[idx] for idx in self._always):
+			self._everywhere = [(idx, self._intensities[idx], 1.) for idx in self._always]
+
+	def __str__(self):
+		return "LightSet({} lights, {} everywhere, {} grid cells, cutoff {}, samples {})".format(
+				len(self.lights), len(self._always), len(self._cells), self.cutoff, self.samples)
+
+	__repr__ = __str__
+
+	def __len__(self):
+		return len(self.lights)
+
+	def __getitem__(self, item: int):
+		return self.lights[item]
+
+	# behaviour
+
+	def geometry(self) -> list:
+		# what decides which lights reach a point and are tested for shadows, see gbuffer.geometrykey
+		parts = [self.cutoff, self.samples]
+		for light in self.lights:
+			parts.append((tuple(light.origin), light.falloff, light.intensity if light.falloff else None))
+		return parts
+
+	def cellof(self, point) -> tuple:
+		# grid cell of the point (a Vector), None where only the lights that reach everywhere do
+		if not self._cells:
+			return None
+		key = (floor(point.x / self.cellsize), floor(point.y / self.cellsize), floor(point.z / self.cellsize))
+		return key if key in self._cells else None
+
+	def reach(self, idx: int, point) -> float:
+		# intensity of the light at the point, None if it is below cutoff there
+		falloff = self._falloffs[idx]
+		if not falloff:
+			return self._intensities[idx]
+		ox, oy, oz = self._origins[idx]
+		x, y, z = ox - point.x, oy - point.y, oz - point.z
+		intensity = self._intensities[idx] / (1 + (x * x + y * y + z * z) / (falloff * falloff))
+		return intensity if intensity >= self.cutoff else None
+
+	def near(self, point) -> list:
+		# [(light, intensity at point)] of the lights that reach the point, by index
+		found = []
+		for idx in self._cells.get(self.cellof(point), self._always):
+			intensity = self.reach(idx, point)
+			if intensity is not None:
+				found.append((idx, intensity))
+		return found
+
+	def importance(self, key) -> tuple:
+		# (candidates, importances, cdf) of a cell: the most any of its lights gives anywhere in the
+		# cell, the falloff from the nearest point of the cell's box, and their running sum
+		if key not in self._importance:
+			candidates = self.cells[key] if key is not None else self.always
+			importances = self.intensities[candidates]
+			if key is not None:
+				lo = array(key, dtype=float64) * self.cellsize
+				outside = maximum(maximum(lo - self.origins[candidates], self.origins[candidates] - (lo + self.cellsize)), 0)
+				falloffs = self.falloffs[candidates]
+				falling = (falloffs > 0).nonzero()[0]
+				importances[falling] = importances[falling] / (
+						1 + rowdot(outside[falling], outside[falling]) / (falloffs[falling] * falloffs[falling]))
+			if not importances.sum() > 0:  # no light gives anything, every one is as likely
+				importances = ones(len(candidates))
+			self._importance[key] = (candidates, importances, importances.cumsum())
+		return self._importance[key]
+
+	def draw(self, point) -> list:
+		# [(light, intensity at point, weight)] of the lights to shade the point with: with samples
+		# and more lights in its cell, that many drawn by their importance, otherwise near()
+		if self._everywhere is not None and len(self._everywhere) <= (self.samples or inf):
+			return self._everywhere
+		key = self.cellof(point)
+		if not self.samples or len(self._cells.get(key, self._always)) <= self.samples:
+			return [(idx, intensity, 1.) for idx, intensity in self.near(point)]
+
+		if key not in self._drawing:
+			self._drawing[key] = tuple(values.tolist() for values in self.importance(key))
+		candidates, importances, cdf = self._drawing[key]
+		total, last = cdf[-1], len(candidates) - 1
+		drawn = []
+		for u in uniformsat(point, self.samples):
+			position = min(bisect_right(cdf, u * total), last)
+			idx = candidates[position]
+			intensity = self.reach(idx, point)
+			if intensity is not None:
+				drawn.append((idx, intensity, total / (self.samples * importances[position])))
+		return drawn
+
+	def intensities_at(self, points: ndarray, lights: ndarray) -> ndarray:
+		# (P,) intensity of the lights at the (P, 3) points, a pair per row
+		intensities = self.intensities[lights]
+		falling = (self.falloffs[lights] > 0).nonzero()[0]
+		if len(falling):
+			tolight = self.origins[lights[falling]] - points[falling]
+			falloffs = self.falloffs[lights[falling]]
+			intensities[falling] = intensities[falling] / (1 + rowdot(tolight, tolight) / (falloffs * falloffs))
+		return intensities
+
+	def draws(self, points: ndarray) -> tuple:
+		# draw() for (N, 3) points: (P,) hits, lights, intensities and weights, sorted by hit and, within
+		# a hit, by light or in the order drawn
+		hits, lights, weights = [zeros(0, dtype=int64)], [zeros(0, dtype=int64)], [zeros(0)]
+		draws = uniforms(points, self.samples) if self.samples else None
+		for key, on in self.groups(points):
+			candidates, importances, cdf = self.importance(key)
+			if not self.samples or len(candidates) <= self.samples:
+				hits.append(repeat(on, len(candidates)))
+				lights.append(tile(candidates, len(on)))
+				weights.append(ones(len(on) * len(candidates)))
+				continue
+			total = cdf[-1]
+			positions = minimum(searchsorted(cdf, draws[on] * total, side="right"),
+								len(candidates) - 1).ravel()
+			hits.append(repeat(on, self.samples))
+			lights.append(candidates[positions])
+			weights.append(total / (self.samples * importances[positions]))
+		hits, lights, weights = concatenate(hits), concatenate(lights), concatenate(weights)
+
+		intensities = self.intensities_at(points[hits], lights)
+		keep = ((self.falloffs[lights] == 0) | (intensities >= self.cutoff)).nonzero()[0]
+		order = keep[argsort(hits[keep], kind="stable")]
+		return hits[order], lights[order], intensities[order], weights[order]
+
+	def groups(self, points: ndarray):
+		# (cell, hit numbers) of the (N, 3) points by cellof(), None for the points outside the grid
+		if not self._cells:
+			yield None, arange(len(points))
+			return
+		keys = floors(points / self.cellsize).astype(int64)
+		cells, inverse, counts = unique(keys, axis=0, return_inverse=True, return_counts=True)
+		outside = []
+		for key, on in zip(map(tuple, cells.tolist()), split(argsort(inverse.ravel(), kind="stable"),
+															   cumsum(counts)[:-1])):
+			if key in self._cells:
+				yield key, on
+			else:
+				outside.append(on)
+		if outside:
+			yield None, concatenate(outside)
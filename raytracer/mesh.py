@@ -0,0 +1,444 @@
+from os import path
+
+from numpy import arange, argpartition, array, cross, dtype, einsum, empty, errstate, float64, fromfile, full, inf
+from numpy import broadcast_shapes, int32, int64, maximum, memmap, minimum, ndarray, newaxis, sqrt, where
+
+from raytracer.objects import Vector
+
+_EPS = .0001  # hits closer than this belong to the surface the ray starts on
+_FAR = 1e30  # stands in for 1 / 0 in the slab test
+_PAD = 1e-7
+_MMAP_SIZE = 16 * 1024 * 1024  # binary files from this size on are memory-mapped
+_CHUNK = 1 << 16  # faces gathered at once while building
+_LEAVES = 4096  # leaves kept gathered, see TriangleMesh.leaf
+
+
+class TriangleMesh:
+	"""
+	Triangles packed into contiguous vertex and index arrays, with a flat
+	bounding volume hierarchy over its faces. One mesh is one scene object.
+	Only the vertices (possibly memory-mapped), the faces in tree order and
+	the nodes are kept; the float64 corners and normals of a leaf are
+	gathered from them when a ray gets there, the last _LEAVES of them stay
+	cached. 100k faces take a few megabytes besides the vertices.
+	"""
+
+	# magic
+
+	def __repr__(self):
+		return "TriangleMesh({} vertices, {} faces{})".format(
+				len(self.vertices), len(self.faces), ", {} degenerate left out".format(self.degenerate) if self.degenerate else "")
+
+	__str__ = __repr__
+
+	def __eq__(self, other):
+		return self.__hash__() == other.__hash__()
+
+	def __hash__(self):
+		return hash((id(self.vertices), id(self.faces), self.material))
+
+	def __getstate__(self):
+		# the workers gather their own leaves
+		return dict(self.__dict__, _leaves={})
+
+	def __init__(self, vertices: ndarray, faces: ndarray, material, leafsize=16):
+		self.vertices = vertices  # (V, 3), may be a memmap
+		self.faces = faces  # (F, 3) vertex indices, may be a memmap
+		self.material = material
+		self.leafsize = leafsize
+		self.lastface = -1
+		self._leaves = {}  # start of a leaf -> gather() of it
+
+		# faces without area have no normal and no inside, they are left out
+		flo, fhi, area = self.facebounds()
+		kept = area.nonzero()[0]
+		self.degenerate = len(self.faces) - len(kept)
+		if not len(kept):
+			raise ValueError("a mesh needs at least one face with an area")
+		self.build(flo[kept], fhi[kept], kept)
+
+	# loading
+
+	@classmethod
+	def load(cls, fname: str, material, mmap=None, leafsize=16):
+		# mmap=None maps binary files from _MMAP_SIZE on, True/False force it
+		if mmap is None:
+			mmap = path.getsize(fname) >= _MMAP_SIZE
+
+		ext = path.splitext(fname)[1].lower()
+		if ext == ".obj":
+			vertices, faces = readobj(fname)
+		elif ext == ".ply":
+			vertices, faces = readply(fname, mmap=mmap)
+		else:
+			raise ValueError("unsupported mesh format: {}".format(ext))
+		return cls(vertices, faces, material, leafsize=leafsize)
+
+	# building
+
+	def facebounds(self) -> tuple:
+		# (F, 3) lower and upper corners of the faces and whether they have an area (F,), a chunk
+		# at a time so that the corners of all faces are never in memory at once
+		flo, fhi = empty((len(self.faces), 3)), empty((len(self.faces), 3))
+		area = empty(len(self.faces), dtype=bool)
+		for start in range(0, len(self.faces), _CHUNK):
+			a, b, c = self.corners(array(self.faces[start:start + _CHUNK]))
+			flo[start:start + _CHUNK] = minimum(minimum(a, b), c)
+			fhi[start:start + _CHUNK] = maximum(maximum(a, b), c)
+			n = cross(b - a, c - a)  # as in gather()
+			area[start:start + _CHUNK] = einsum("ij,ij->i", n, n) > 0
+		return flo, fhi, area
+
+	def build(self, flo: ndarray, fhi: ndarray, faces: ndarray):
+		# the tree over the faces of the given (K,) indices, with their (K, 3) bounds
+		centroids = (flo + fhi) / 2
+
+		order = arange(len(flo))
+		nodes = []  # [lo, hi, left, right, start, end, axis]
+		pending = [(0, len(flo), -1, 2)]  # face range, parent and the parent's slot for the child
+
+		while pending:
+			start, end, parent, slot = pending.pop()
+			idx = order[start:end]
+			node = len(nodes)
+			nodes.append([flo[idx].min(axis=0) - _PAD, fhi[idx].max(axis=0) + _PAD, -1, -1, start, end, 0])
+			if parent >= 0:
+				nodes[parent][slot] = node
+
+			if end - start <= self.leafsize:
+				continue
+
+			extent = centroids[idx].max(axis=0) - centroids[idx].min(axis=0)
+			axis = int(extent.argmax())
+			if extent[axis] <= 0:
+				continue
+
+			mid = (end - start) // 2
+			order[start:end] = idx[argpartition(centroids[idx, axis], mid)]
+			nodes[node][6] = axis  # the left child holds the lower half along axis
+			pending.append((start + mid, end, node, 3))
+			pending.append((start, start + mid, node, 2))
+
+		# faces reordered, so that every leaf covers a contiguous range
+		self.packed = array(self.faces[faces[order]])
+
+		self.nodelo = array([node[0] for node in nodes])
+		self.nodehi = array([node[1] for node in nodes])
+		self.nodes = [
+			(tuple(map(float, lo)), tuple(map(float, hi)), left, right, start, end, axis)
+			for lo, hi, left, right, start, end, axis in nodes
+		]
+
+	# behaviour
+
+	def items(self):
+		return self.vertices, self.faces
+
+	def corners(self, faces: ndarray) -> tuple:
+		# float64 corners a, b, c of the (K, 3) faces
+		return tuple(array(self.vertices[faces[:, k]], dtype=float64) for k in range(3))
+
+	def gather(self, faces) -> tuple:
+		# (a, u, v, normals) of the packed faces (a slice or indices), the edges as in Triangle
+		a, b, c = self.corners(self.packed[faces])
+		u, v = b - a, c - a
+		n = cross(u, v)
+		with errstate(divide="ignore", invalid="ignore"):  # no degenerate faces are packed, see __init__
+			return a, u, v, n / sqrt(einsum("ij,ij->i", n, n))[:, newaxis]
+
+	def leaf(self, start: int, end: int) -> tuple:
+		# gather() of the faces start:end of a leaf; the oldest one goes once _LEAVES are kept
+		gathered = self._leaves.get(start)
+		if gathered is None:
+			if len(self._leaves) >= _LEAVES:
+				del self._leaves[next(iter(self._leaves))]
+			gathered = self._leaves[start] = self.gather(slice(start, end))
+		return gathered
+
+	def bounds(self):
+		return self.nodelo[0], self.nodehi[0]
+
+	def hits(self, o: ndarray, d: ndarray, start: int, end: int) -> ndarray:
+		# distances of one ray to the faces start:end of a leaf, inf on miss; same test as Triangle
+		a, u, v, _ = self.leaf(start, end)
+		w = o - a
+		dv = _cross(d, v)
+		dvu = einsum("ij,ij->i", dv, u)
+		wu = _cross(w, u)
+
+		with errstate(divide="ignore", invalid="ignore"):
+			r = einsum("ij,ij->i", dv, w) / dvu
+			s = wu.dot(d) / dvu
+			t = einsum("ij,ij->i", wu, v) / dvu
+		inside = (dvu != 0) & (r >= 0) & (r <= 1) & (s >= 0) & (s <= 1) & (r + s <= 1) & (t > _EPS)
+		return where(inside, t, inf)
+
+	def intersectionparameter(self, ray) -> float:
+		o = array(ray.origin.xyz, dtype=float64)
+		d = array(ray.direction.xyz, dtype=float64)
+		ox, oy, oz = o.tolist()
+		inv = [1.0 / c if c else _FAR for c in d.tolist()]
+
+		d3 = d.tolist()
+		best, face = inf, -1
+		stack = [0]
+		while stack:
+			lo, hi, left, right, start, end, axis = self.nodes[stack.pop()]
+
+			tmin, tmax = _EPS, best
+			for a, oa in ((0, ox), (1, oy), (2, oz)):
+				t0 = (lo[a] - oa) * inv[a]
+				t1 = (hi[a] - oa) * inv[a]
+				if t0 > t1:
+					t0, t1 = t1, t0
+				if t0 > tmin: tmin = t0
+				if t1 < tmax: tmax = t1
+			if tmin > tmax:
+				continue
+
+			if left >= 0:
+				# front to back, so that near hits prune the far child
+				if d3[axis] < 0:
+					stack.append(left)
+					stack.append(right)
+				else:
+					stack.append(right)
+					stack.append(left)
+				continue
+
+			t = self.hits(o, d, start, end)
+			nearest = int(t.argmin())
+			if t[nearest] < best:
+				best, face = float(t[nearest]), start + nearest
+
+		if face < 0:
+			return None
+		self.lastface = face
+		return best
+
+	def intersectionparameters(self, origins: ndarray, directions: ndarray) -> ndarray:
+		n = len(origins)
+		best = full(n, inf)
+		with errstate(divide="ignore"):
+			inv = where(directions == 0, _FAR, 1.0 / directions)
+
+		stack = [(0, arange(n))]
+		while stack:
+			node, rays = stack.pop()
+			_, _, left, right, start, end, axis = self.nodes[node]
+
+			t0 = (self.nodelo[node] - origins[rays]) * inv[rays]
+			t1 = (self.nodehi[node] - origins[rays]) * inv[rays]
+			enter = maximum(minimum(t0, t1).max(axis=1), _EPS)
+			leave = minimum(maximum(t0, t1).min(axis=1), best[rays])
+			rays = rays[enter <= leave]
+			if not len(rays):
+				continue
+
+			if left >= 0:
+				if directions[rays, axis].sum() < 0:
+					stack.append((left, rays))
+					stack.append((right, rays))
+				else:
+					stack.append((right, rays))
+					stack.append((left, rays))
+				continue
+
+			# all rays against all faces of the leaf, (R, K) at once
+			o, d = origins[rays][:, newaxis, :], directions[rays][:, newaxis, :]
+			a, u, v, _ = self.leaf(start, end)
+			u, v = u[newaxis], v[newaxis]
+			w = o - a[newaxis]
+			dv = _cross(d, v)
+			dvu = einsum("rkj,rkj->rk", dv, u)
+			wu = _cross(w, u)
+			with errstate(divide="ignore", invalid="ignore"):
+				r = einsum("rkj,rkj->rk", dv, w) / dvu
+				s = einsum("rkj,rkj->rk", wu, d) / dvu
+				t = einsum("rkj,rkj->rk", wu, v) / dvu
+			inside = (dvu != 0) & (r >= 0) & (r <= 1) & (s >= 0) & (s <= 1) & (r + s <= 1) & (t > _EPS)
+			t = where(inside, t, inf).min(axis=1)
+			closer = t < best[rays]
+			best[rays[closer]] = t[closer]
+		return best
+
+	def faceat(self, p: ndarray) -> int:
+		# face a hit point lies on; the face of the last scalar hit is checked first
+		if self.lastface >= 0 and self.distanceto(p, *self.gather(slice(self.lastface, self.lastface + 1)))[0] <= _EPS:
+			return self.lastface
+
+		nearest, face = inf, -1
+		stack = [0]
+		while stack:
+			lo, hi, left, right, start, end, _ = self.nodes[stack.pop()]
+			if any(p[a] < lo[a] - _EPS or p[a] > hi[a] + _EPS for a in range(3)):
+				continue
+			if left >= 0:
+				stack.append(right)
+				stack.append(left)
+				continue
+
+			dist = self.distanceto(p, *self.leaf(start, end))
+			idx = int(dist.argmin())
+			if dist[idx] < nearest:
+				nearest, face = dist[idx], start + idx
+		return face
+
+	def distanceto(self, p: ndarray, a: ndarray, u: ndarray, v: ndarray, normals: ndarray) -> ndarray:
+		# distance of p to the planes of gathered faces, inf where p lies outside a face
+		w = p - a
+		d00 = einsum("ij,ij->i", u, u)
+		d01 = einsum("ij,ij->i", u, v)
+		d11 = einsum("ij,ij->i", v, v)
+		d20 = einsum("ij,ij->i", w, u)
+		d21 = einsum("ij,ij->i", w, v)
+		with errstate(divide="ignore", invalid="ignore"):
+			denom = d00 * d11 - d01 * d01
+			beta = (d11 * d20 - d01 * d21) / denom
+			gamma = (d00 * d21 - d01 * d20) / denom
+		tol = 1e-6
+		inside = (beta >= -tol) & (gamma >= -tol) & (beta + gamma <= 1 + tol)
+		return where(inside, abs(einsum("ij,ij->i", w, normals)), inf)
+
+	def normalat(self, p: Vector) -> Vector:
+		return Vector(self.gather(array([self.faceat(array(p.xyz, dtype=float64))]))[3][0])
+
+	def normalsat(self, points: ndarray) -> ndarray:
+		# one face lookup per point, neighbouring points mostly hit the last face again
+		return self.gather(array([self.faceat(p) for p in points], dtype=int64))[3]
+
+
+def _cross(a: ndarray, b: ndarray) -> ndarray:
+	# numpy.cross over the last axis without its axis juggling, which dominates for small leaves
+	c = empty(broadcast_shapes(a.shape, b.shape))
+	c[..., 0] = a[..., 1] * b[..., 2] - a[..., 2] * b[..., 1]
+	c[..., 1] = a[..., 2] * b[..., 0] - a[..., 0] * b[..., 2]
+	c[..., 2] = a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+	return c
+
+
+# loaders
+
+def readobj(fname: str):
+	# vertices and faces of a Wavefront OBJ; polygons are fanned into triangles
+	coords, indices = [], []
+	with open(fname) as file:
+		for line in file:
+			if line.startswith("v "):
+				coords.extend(line.split()[1:4])
+			elif line.startswith("f "):
+				count = len(coords) // 3
+				poly = []
+				for ref in line.split()[1:]:
+					idx = int(ref.split("/")[0])
+					poly.append(idx - 1 if idx > 0 else count + idx)
+				for i in range(1, len(poly) - 1):
+					indices.extend((poly[0], poly[i], poly[i + 1]))
+
+	vertices = array(coords, dtype=float64).reshape(-1, 3)
+	faces = array(indices, dtype=int32).reshape(-1, 3)
+	return vertices, faces
+
+
+_PLY_TYPES = {
+	"char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+	"short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+	"int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+	"float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+
+
+def readply(fname: str, mmap=False):
+	# vertices and faces of an ascii or binary PLY; binary data can be memory-mapped
+	with open(fname, "rb") as file:
+		if file.readline().strip() != b"ply":
+			raise ValueError("not a PLY file: {}".format(fname))
+
+		fmt, elements = None, []
+		while True:
+			line = file.readline()
+			if not line:
+				raise ValueError("PLY header without end_header: {}".format(fname))
+			words = line.decode("ascii").split()
+			if not words:
+				continue
+			if words[0] == "format":
+				fmt = words[1]
+			elif words[0] == "element":
+				elements.append((words[1], int(words[2]), []))
+			elif words[0] == "property":
+				elements[-1][2].append(words[1:])
+			elif words[0] == "end_header":
+				break
+		offset = file.tell()
+
+		if fmt == "ascii":
+			return _readplyascii(file, elements)
+
+	order = "<" if fmt == "binary_little_endian" else ">"
+	vertices, faces = None, None
+	for name, count, props in elements:
+		if any(prop[0] == "list" for prop in props):
+			# only triangle lists have a fixed row size that can be mapped
+			if len(props) != 1:
+				raise ValueError("unsupported PLY face layout in {}".format(fname))
+			_, counttype, indextype, _ = props[0]
+			rowtype = dtype([("n", order + _PLY_TYPES[counttype]), ("i", order + _PLY_TYPES[indextype], 3)])
+			rows = _view(fname, rowtype, offset, count, mmap)
+			if count and (rows["n"] != 3).any():
+				raise ValueError("only triangle faces are supported in binary PLY: {}".format(fname))
+			if name == "face":
+				faces = rows["i"]
+		else:
+			rowtype = dtype([(prop[1], order + _PLY_TYPES[prop[0]]) for prop in props])
+			rows = _view(fname, rowtype, offset, count, mmap)
+			if name == "vertex":
+				vertices = _xyz(rows)
+		offset += rowtype.itemsize * count
+
+	return vertices, faces
+
+
+def _view(fname: str, rowtype, offset: int, count: int, mmap: bool) -> ndarray:
+	if mmap:
+		return memmap(fname, dtype=rowtype, mode="r", offset=offset, shape=(count,))
+	with open(fname, "rb") as file:
+		file.seek(offset)
+		return fromfile(file, dtype=rowtype, count=count)
+
+
+def _xyz(rows: ndarray) -> ndarray:
+	fields = rows.dtype.fields
+	fieldtype = fields["x"][0]
+	packed = all(fields[name][0] == fieldtype and fields[name][1] == a * fieldtype.itemsize
+				 for a, name in enumerate(("x", "y", "z")))
+	if packed:
+		# x, y, z lead every row, a strided view keeps the memory mapping
+		return ndarray((len(rows), 3), dtype=fieldtype, buffer=rows,
+					   strides=(rows.dtype.itemsize, fieldtype.itemsize))
+	return _stack(rows)
+
+
+def _stack(rows: ndarray) -> ndarray:
+	out = empty((len(rows), 3), dtype=float64)
+	for a, name in enumerate(("x", "y", "z")):
+		out[:, a] = rows[name]
+	return out
+
+
+def _readplyascii(file, elements: list):
+	vertices, faces = [], []
+	for name, count, props in elements:
+		names = [prop[-1] for prop in props]
+		for _ in range(count):
+			values = file.readline().split()
+			if name == "vertex":
+				row = dict(zip(names, values))
+				vertices.append((row["x"], row["y"], row["z"]))
+			elif name == "face":
+				n = int(values[0])
+				poly = [int(i) for i in values[1:n + 1]]
+				for i in range(1, n - 1):
+					faces.append((poly[0], poly[i], poly[i + 1]))
+
+	return array(vertices, dtype=float64).reshape(-1, 3), array(faces, dtype=int32).reshape(-1, 3)
@@ -1,11 +1,25 @@
 from abc import abstractmethod
+from copy import copy
 
-from numpy import abs, add, cross, divide, dot, multiply, sqrt, subtract, sum, tan
-from numpy import array, float64, ndarray
-from numpy.linalg import norm
+from math import sqrt
+
+from numpy import array, broadcast_to, cross, dot, errstate, float64, inf, int64, ndarray, tan, where
+from numpy import sqrt as npsqrt
+
+
+def rowdot(a: ndarray, b: ndarray) -> ndarray:
+	# row-wise dot product of (N, 3) arrays (or one of them a single (3,) row),
+	# summed in the same order as Vector.dot, so results match the scalar path
+	return a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1] + a[..., 2] * b[..., 2]
 
 
 class HitPointData:
+	"""
+	A hit of a ray at distance on object. The intersection point, the normal
+	there and the reflected direction are worked out on first use and kept,
+	hits that are only tested for (shadows, misses) never compute them.
+	"""
+	__slots__ = ("ray", "object", "distance", "_intersection", "_normal", "_reflected")
 
 	# magic
 
@@ -13,16 +27,33 @@ class HitPointData:
 		self.ray = ray
 		self.object = object
 		self.distance = distance
-		self.intersection = ray.point_at(self.distance)
-		self.normal = object.normalat(self.intersection)
-		self.reflected = ray.direction.reflect(self.normal).normalized()
+		self._intersection = None
+		self._normal = None
+		self._reflected = None
 
 	def __iter__(self):
-		for d in self.data(): yield d
-		raise StopIteration
+		yield from self.data()
 
 	# behaviour
 
+	@property
+	def intersection(self) -> "Vector":
+		if self._intersection is None:
+			self._intersection = self.ray.point_at(self.distance)
+		return self._intersection
+
+	@property
+	def normal(self) -> "Vector":
+		if self._normal is None:
+			self._normal = self.object.normalat(self.intersection)
+		return self._normal
+
+	@property
+	def reflected(self) -> "Vector":
+		if self._reflected is None:
+			self._reflected = self.ray.direction.reflect(self.normal).normalized()
+		return self._reflected
+
 	def data(self) -> tuple:
 		return self.ray, self.object, self.distance, self.intersection, self.normal, self.reflected
 
@@ -98,6 +129,46 @@ class Color:
 		return array(list(rgb))
 
 
+class Radiance:
+	"""
+	Float color used while shading. Unlike Color it is never clamped or cast,
+	that happens once per pixel when it is written to the framebuffer.
+	"""
+	__slots__ = ("r", "g", "b")
+
+	# magic
+
+	def __add__(self, other):
+		return Radiance(self.r + other.r, self.g + other.g, self.b + other.b)
+
+	__radd__ = __add__
+
+	def __mul__(self, other):
+		if isinstance(other, Radiance):
+			return Radiance(self.r * other.r, self.g * other.g, self.b * other.b)
+		return Radiance(self.r * other, self.g * other, self.b * other)
+
+	__rmul__ = __mul__
+
+	def __str__(self):
+		return "Radiance({}, {}, {})".format(self.r, self.g, self.b)
+
+	__repr__ = __str__
+
+	def __init__(self, r=.0, g=.0, b=.0):
+		self.r = r
+		self.g = g
+		self.b = b
+
+	# behaviour
+
+	def items(self):
+		return self.r, self.g, self.b
+
+	def tocolor(self) -> Color:
+		return Color(self.r, self.g, self.b)
+
+
 class isMaterial:
 
 	@abstractmethod
@@ -105,7 +176,7 @@ class isMaterial:
 		pass
 
 	@abstractmethod
-	def calccolor(self, shaded=False, phi=.0, theta=.0, intensity=1) -> Color:
+	def calccolor(self, shaded=False, phi=.0, theta=.0, intensity=1) -> Radiance:
 		pass
 
 
@@ -145,54 +216,68 @@ class Material(isMaterial):
 	def getcolor(self, p=None):
 		return self.color
 
-	def calcshaded(self):
-		return self.color * self.__SHADOW
+	def copy(self):
+		# levels and all, the color is shared
+		return copy(self)
+
+	def calcshaded(self) -> Radiance:
+		r, g, b = self.color.rgb.tolist()
+		return Radiance(r * self.__SHADOW, g * self.__SHADOW, b * self.__SHADOW)
 
-	def calccolor(self, phi=.0, theta=.0, intensity=1, p=None, shaded=False) -> Color:
+	def calccolor(self, phi=.0, theta=.0, intensity=1, p=None, shaded=False) -> Radiance:
 		if shaded:
 			return self.calcshaded()
 
-		res = self.color * intensity * self.ambLvl
-		res = res + self.color * intensity * self.diffLvl * phi
-		res = res + self.color * intensity * self.specLvl * (theta ** self.surface)
-		return res
+		# light facing away contributes nothing instead of darkening
+		level = self.ambLvl
+		level += self.diffLvl * max(phi, .0)
+		level += self.specLvl * (max(theta, .0) ** self.surface)
+		level *= intensity
+
+		r, g, b = self.color.rgb.tolist()
+		return Radiance(r * level, g * level, b * level)
 
 
 class Vector:
+	__slots__ = ("x", "y", "z")
 
 	# magic
 
 	def __getitem__(self, item: (int, slice)):
-		return self.xyz[item]
+		return (self.x, self.y, self.z)[item]
 
 	def __iter__(self):
-		for i in self.xyz: yield i
-		raise StopIteration
+		yield self.x
+		yield self.y
+		yield self.z
 
 	def __add__(self, other):
-		return Vector(add(self.xyz, other.xyz))
+		return _vector(self.x + other.x, self.y + other.y, self.z + other.z)
 
 	__radd__ = __add__
 
 	def __sub__(self, other):
-		return Vector(subtract(self.xyz, other.xyz))
+		return _vector(self.x - other.x, self.y - other.y, self.z - other.z)
 
 	__rsub__ = __sub__
 
 	def __mul__(self, other):
-		if isinstance(other, (float, float64, int)):
-			return Vector(multiply(self.xyz, other))
-		return Vector(multiply(self.xyz, other.xyz))
+		if isinstance(other, Vector):
+			return _vector(self.x * other.x, self.y * other.y, self.z * other.z)
+		return _vector(self.x * other, self.y * other, self.z * other)
 
 	__rmul__ = __mul__
 
 	def __truediv__(self, other):
-		if isinstance(other, (float, float64, int)):
-			return Vector(divide(self.xyz, other))
-		return Vector(divide(self.xyz, other.xyz))
+		if isinstance(other, Vector):
+			return _vector(self.x / other.x, self.y / other.y, self.z / other.z)
+		return _vector(self.x / other, self.y / other, self.z / other)
 
 	__rdiv__ = __truediv__
 
+	def __neg__(self):
+		return _vector(-self.x, -self.y, -self.z)
+
 	def __int__(self):
 		return self.dot(self)
 
@@ -203,39 +288,62 @@ class Vector:
 
 	def __init__(self, x, y=0, z=0):
 		if isinstance(x, Vector):
-			x, y, z = x.items()
-		elif type(x) in (tuple, list, array, ndarray):
+			x, y, z = x.x, x.y, x.z
+		elif isinstance(x, (tuple, list, ndarray)):
 			x, y, z = x
-		self.xyz = array([x, y, z])
+		self.x = float(x)
+		self.y = float(y)
+		self.z = float(z)
 
 	# behaviour
 
 	scale = __mul__  # s must be a scalar/int/float
 
+	@property
+	def xyz(self) -> ndarray:
+		# array copy for the batched NumPy code
+		return array((self.x, self.y, self.z))
+
 	def items(self):
-		return self.xyz
+		return self.x, self.y, self.z
 
 	def dot(self, other):
-		return dot(self.xyz, other.xyz)
+		return self.x * other.x + self.y * other.y + self.z * other.z
 
 	def cross(self, other):
-		return Vector(cross(self.xyz, other.xyz))
+		return _vector(
+				self.y * other.z - self.z * other.y,
+				self.z * other.x - self.x * other.z,
+				self.x * other.y - self.y * other.x)
 
 	def length(self):
-		return norm(self.xyz)
+		return sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
 
 	def normalized(self):
 		return self / self.length()
 
 	def reflect(self, axis):
 		axis = axis.normalized()  # normalize to be safe
-		return self - multiply(self.dot(axis), 2 * axis)  # (S48)
+		d = self.dot(axis)
+		return _vector(self.x - 2 * axis.x * d, self.y - 2 * axis.y * d, self.z - 2 * axis.z * d)  # (S48)
 
 	def vectorto(self, b):
 		# vector from self (point a) to point b
 		return b - self
 
 
+def _vector(x: float, y: float, z: float) -> Vector:
+	# skips the argument checks of Vector.__init__ for values that are floats already
+	v = _new(Vector)
+	v.x = x
+	v.y = y
+	v.z = z
+	return v
+
+
+_new = object.__new__
+
+
 class isTexture:
 
 	@abstractmethod
@@ -243,7 +351,18 @@ class isTexture:
 		pass
 
 	@abstractmethod
-	def calccolor(self, p: Vector, phi=.0, theta=.0, intensity=1, shaded=False) -> Color:
+	def calccolor(self, p: Vector, phi=.0, theta=.0, intensity=1, shaded=False) -> Radiance:
+		pass
+
+	@abstractmethod
+	def materials(self) -> list:
+		# the materials the texture picks from, in the order of the indices of sample()
+		pass
+
+	@abstractmethod
+	def sample(self, points: ndarray) -> tuple:
+		# (N,) material indices and (N, 3) float colors at (N, 3) points, the same
+		# materials getmat picks one point at a time
 		pass
 
 
@@ -277,15 +396,33 @@ class CheckerBoard(isTexture):
 		self.surface = surface
 
 	def getmat(self, p=None) -> Material:
-		v = p.scale(1.0 / self.size)
+		k = 1.0 / self.size  # p.scale(k), rounded to the nearest cell per axis
 
-		material = self.firstMat
-		if sum(list(map(lambda x: int(abs(x) + .5), v.xyz))) % 2:
-			material = self.secondMat
-		return material
+		if (int(abs(p.x * k) + .5) + int(abs(p.y * k) + .5) + int(abs(p.z * k) + .5)) % 2:
+			return self.secondMat
+		return self.firstMat
+
+	def getcolor(self, p=None) -> Color:
+		return self.getmat(p).color
+
+	def materials(self) -> list:
+		return [self.firstMat, self.secondMat]
+
+	def sample(self, points: ndarray) -> tuple:
+		# same arithmetic as getmat, on all points at once
+		cells = (abs(points * (1.0 / self.size)) + .5).astype(int64)
+		indices = (cells[:, 0] + cells[:, 1] + cells[:, 2]) % 2
+		colors = array([self.firstMat.color.rgb, self.secondMat.color.rgb], dtype=float64)
+		return indices, colors[indices]
+
+	def copy(self):
+		# a checkerboard of its own, with materials of its own
+		checker = copy(self)
+		checker.firstMat, checker.secondMat = self.firstMat.copy(), self.secondMat.copy()
+		return checker
 
 	def setsize(self, size):
-		checker = eval(repr(self))
+		checker = self.copy()
 		checker.size = size
 		return checker
 
@@ -294,6 +431,7 @@ class CheckerBoard(isTexture):
 
 
 class Ray:
+	__slots__ = ("origin", "direction")
 
 	# magic
 
@@ -317,17 +455,16 @@ class Light:
 	# magic
 
 	def __str__(self):
-		return "Light({}, {}, {})".format(
-				str(self.origin),
-				str(self.color),
-				str(self.intensity), )
+		data = (self.origin, self.color, self.intensity) + ((self.falloff,) if self.falloff else ())
+		return "Light({})".format(", ".join(map(str, data)))
 
 	__repr__ = __str__
 
-	def __init__(self, origin: Vector, color: Color, intensity=1.0):
+	def __init__(self, origin: Vector, color: Color, intensity=1.0, falloff=None):
 		self.origin = origin
 		self.color = color
 		self.intensity = intensity
+		self.falloff = falloff  # distance at which the intensity is halved, None for no falloff
 
 
 class Camera:
@@ -397,12 +534,32 @@ class Sphere:
 		else:
 			return v - sqrt(discriminant)
 
+	def intersectionparameters(self, origins: ndarray, directions: ndarray) -> ndarray:
+		"""
+		:return: (N,) hit distances; inf where a ray misses
+		"""
+		co = self.center.xyz - origins
+		v = rowdot(co, directions)
+		discriminant = v * v - rowdot(co, co) + self.radius * self.radius
+
+		with errstate(invalid="ignore"):
+			return where(discriminant < 0, inf, v - npsqrt(discriminant))
+
 	def items(self):
 		return self.center, self.radius
 
+	def bounds(self):
+		# axis-aligned bounding box as (lower corner, upper corner)
+		return self.center.xyz - self.radius, self.center.xyz + self.radius
+
 	def normalat(self, p: Vector) -> Vector:
 		return self.center.vectorto(p).normalized()
 
+	def normalsat(self, points: ndarray) -> ndarray:
+		# (N, 3) normalat of (N, 3) points
+		v = points - self.center.xyz
+		return v / npsqrt(rowdot(v, v))[:, None]
+
 
 class Plane:
 
@@ -435,12 +592,26 @@ class Plane:
 		else:
 			return None
 
+	def intersectionparameters(self, origins: ndarray, directions: ndarray) -> ndarray:
+		op = origins - self.origin.xyz
+		a = rowdot(op, self.normal.xyz)
+		b = rowdot(directions, self.normal.xyz)
+
+		with errstate(divide="ignore", invalid="ignore"):
+			return where(b != 0, -a / b, inf)
+
 	def items(self):
 		return self.origin, self.normal
 
+	def bounds(self):
+		return None  # unbounded
+
 	def normalat(self, p=None) -> Vector:
 		return self.normal
 
+	def normalsat(self, points: ndarray) -> ndarray:
+		return broadcast_to(self.normal.xyz, points.shape)
+
 
 class Triangle:
 
@@ -483,12 +654,35 @@ class Triangle:
 		else:
 			return None
 
+	def intersectionparameters(self, origins: ndarray, directions: ndarray) -> ndarray:
+		u, v = self.u.xyz, self.v.xyz
+
+		w = origins - self.a.xyz
+		dv = cross(directions, v)
+		dvu = rowdot(dv, u)
+
+		wu = cross(w, u)
+		with errstate(divide="ignore", invalid="ignore"):
+			r = rowdot(dv, w) / dvu
+			s = rowdot(wu, directions) / dvu
+			t = rowdot(wu, v) / dvu
+
+		inside = (dvu != 0.0) & (0 <= r) & (r <= 1) & (0 <= s) & (s <= 1) & (r + s <= 1)
+		return where(inside, t, inf)
+
 	def items(self):
 		return self.a, self.b, self.c
 
+	def bounds(self):
+		corners = array([self.a.xyz, self.b.xyz, self.c.xyz])
+		return corners.min(axis=0), corners.max(axis=0)
+
 	def normalat(self, p=None) -> Vector:
 		return Vector(self.u.cross(self.v).normalized())
 
+	def normalsat(self, points: ndarray) -> ndarray:
+		return broadcast_to(self.normalat().xyz, points.shape)
+
 # RENDER OBJECTS END
 
 
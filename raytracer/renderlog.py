@@ -0,0 +1,37 @@
+import json
+from hashlib import sha1
+from resource import RUSAGE_CHILDREN, RUSAGE_SELF, getrusage
+
+from numpy import ascontiguousarray
+
+
+def scenehash(camera, lights: list, objects: list) -> str:
+	# content hash of a scene, equal for equal scenes across runs and machines
+	digest = sha1()
+	for part in [camera] + list(lights) + list(objects):
+		digest.update(str(part).encode())
+		material = getattr(part, "material", None)
+		if material is not None:
+			digest.update(str(material).encode())
+		for name in ("vertices", "faces"):  # meshes only print their size
+			data = getattr(part, name, None)
+			if data is not None:
+				digest.update(ascontiguousarray(data).tobytes())
+	return digest.hexdigest()[:16]
+
+
+def usage() -> dict:
+	# cpu seconds so far of this process and its finished children (the render workers),
+	# peak resident set sizes in MB (ru_maxrss is in kB on Linux)
+	own, children = getrusage(RUSAGE_SELF), getrusage(RUSAGE_CHILDREN)
+	return {
+		"cpu": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+		"rss": own.ru_maxrss / 1024.,
+		"rss_children": children.ru_maxrss / 1024.,
+	}
+
+
+def appendrecord(fname: str, record: dict):
+	# one JSON object per line, pandas.read_json(fname, lines=True) loads the log as a table
+	with open(fname, "a") as file:
+		file.write(json.dumps(record, sort_keys=True) + "\n")
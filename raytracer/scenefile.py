@@ -0,0 +1,248 @@
+import json
+from hashlib import sha1
+from os import makedirs, path, replace, stat
+
+from numpy import array, concatenate, empty, float64, frombuffer, int32, load, savez, uint8
+
+from raytracer.coloring import materialsContainer
+from raytracer.mesh import TriangleMesh
+from raytracer.objects import Camera, CheckerBoard, Color, Light, Material, Plane, Sphere, Triangle, Vector
+
+# scene files: JSON, compiled once into packed arrays that are cached as .npz next to the file.
+#
+# {
+#	"camera": {"origin": [0, 45, -75], "focus": [0, 35, 100], "up": [0, -1, 0], "fov": 20},
+#	"light": {"origin": [50, 175, 20], "color": [255, 255, 255], "intensity": 1},
+#	"lights": [{"origin": [-40, 20, 60], "intensity": .5, "falloff": 40}, ...],
+#	"materials": {"shiny": {"color": [200, 30, 30], "ambient": .4, "diffuse": .9, "specular": .6, "surface": 40},
+#				  "tiles": {"checkerboard": {"first": "black", "second": "white", "size": 15}}},
+#	"objects": [
+#		{"type": "sphere", "center": [0, 0, 100], "radius": 30, "material": "shiny"},
+#		{"type": "plane", "origin": [0, -40, 0], "normal": [0, 1, 0], "material": "tiles"},
+#		{"type": "triangle", "a": [-50, 0, 140], "b": [0, 70, 140], "c": [50, 0, 140], "material": "yellow"},
+#		{"type": "mesh", "file": "bunny.ply", "material": "grey"}
+#	]
+# }
+#
+# Materials are the names of coloring.materialsContainer or of the file's own "materials";
+# objects without one get the default checkerboard. Mesh files are relative to the scene file.
+# "light" and "lights" add up, the first of them is the one -animate moves; without either the
+# scene has the default light. A light with a falloff distance only reaches so far, see LightSet.
+
+VERSION = 2  # of the compiled form, part of the cache key
+
+# columns of the packed arrays, one row per object of the kind
+KINDS = {
+	"sphere": ("center", "radius"),
+	"plane": ("origin", "normal"),
+	"triangle": ("a", "b", "c"),
+	"mesh": (),
+}
+
+
+class SceneFile:
+	"""
+	A scene file and its compiled form. The first load() parses the JSON,
+	packs camera, lights and the objects of each kind into arrays and saves
+	them to cachedir under the content hash of the file; later loads of the
+	same content read the arrays back (meshes included) and skip the text.
+	A cache whose mesh files have changed since is compiled again.
+	"""
+
+	# magic
+
+	def __init__(self, fname: str, cachedir=None):
+		self.fname = fname
+		self.cachedir = cachedir or path.join(path.dirname(path.abspath(fname)), ".scenecache")
+		with open(fname, "rb") as file:
+			content = file.read()
+		self.hash = sha1(b"%d\n" % VERSION + content).hexdigest()[:16]
+		self.content = content
+		self.cached = False
+
+	def __str__(self):
+		return "SceneFile({}, {})".format(self.fname, self.hash)
+
+	__repr__ = __str__
+
+	# behaviour
+
+	def cachename(self) -> str:
+		name = path.splitext(path.basename(self.fname))[0]
+		return path.join(self.cachedir, "{}-{}.npz".format(name, self.hash))
+
+	def load(self, res=(200, 200)) -> tuple:
+		# (camera, lights, objects) of the scene
+		arrays = self.readcache()
+		self.cached = arrays is not None
+		if arrays is None:
+			arrays = self.compile()
+			self.writecache(arrays)
+		return build(arrays, res)
+
+	def compile(self) -> dict:
+		return compilescene(json.loads(self.content), path.dirname(path.abspath(self.fname)))
+
+	def readcache(self):
+		fname = self.cachename()
+		if not path.isfile(fname):
+			return None
+		with load(fname) as stored:
+			arrays = {key: stored[key] for key in stored.files}
+		if _meshstats(_text(arrays["meshfiles"])) != _text(arrays["meshstats"]):
+			return None  # a mesh file changed, the cached vertices are out of date
+		return arrays
+
+	def writecache(self, arrays: dict):
+		makedirs(self.cachedir, exist_ok=True)
+		fname = self.cachename()
+		with open(fname + ".part", "wb") as file:
+			savez(file, **arrays)
+		replace(fname + ".part", fname)  # readers see the whole cache or none
+
+
+def compilescene(description: dict, directory=".") -> dict:
+	# packed arrays of a parsed scene file
+	camera = description.get("camera", {})
+	lights = ([description["light"]] if "light" in description else []) + list(description.get("lights", []))
+	arrays = {
+		"camera": array(list(camera.get("origin", (0, 45, -75))) + list(camera.get("up", (0, -1, 0))) +
+						list(camera.get("focus", (0, 35, 100))) + [camera.get("fov", 20)], dtype=float64),
+		# a row per light, falloff 0 for none
+		"lights": array([list(light.get("origin", (50, 175, 20))) + list(light.get("color", (255, 255, 255))) +
+						 [light.get("intensity", 1), light.get("falloff") or 0] for light in lights or [{}]],
+						dtype=float64),
+	}
+
+	# the file's own materials first, then the built in ones they and the objects use
+	own = description.get("materials", {})
+	names, specs = {}, []
+
+	def materialindex(name):
+		if name not in names:
+			if name in own:
+				spec = dict(own[name])
+				if "checkerboard" in spec:
+					checker = spec["checkerboard"] = dict(spec["checkerboard"])
+					checker["first"] = materialindex(checker.get("first", "black"))
+					checker["second"] = materialindex(checker.get("second", "white"))
+			elif name in materialsContainer:
+				spec = {"builtin": name}
+			else:
+				raise ValueError("unknown material {!r}, neither in the scene file nor in materialsContainer".format(name))
+			names[name] = len(specs)
+			specs.append(spec)
+		return names[name]
+
+	rows = {kind: [] for kind in KINDS}
+	materials = {kind: [] for kind in KINDS}
+	order, meshfiles, vertices, faces, meshes = [], [], [], [], []
+	for obj in description.get("objects", []):
+		kind = obj.get("type")
+		if kind not in KINDS:
+			raise ValueError("unknown object type {!r}, one of {}".format(kind, ", ".join(KINDS)))
+		order.append((list(KINDS).index(kind), len(rows[kind])))
+		materials[kind].append(materialindex(obj.get("material")))
+		if kind == "mesh":
+			fname = path.join(directory, obj["file"])
+			mesh = TriangleMesh.load(fname, None, mmap=False)
+			meshes.append((sum(map(len, vertices)), sum(map(len, faces)), len(mesh.vertices), len(mesh.faces)))
+			vertices.append(array(mesh.vertices, dtype=float64))
+			faces.append(array(mesh.faces, dtype=int32))
+			meshfiles.append(path.abspath(fname))
+			rows[kind].append(())
+			continue
+		row = []
+		for column in KINDS[kind]:
+			value = obj[column]
+			row.extend(value if isinstance(value, (list, tuple)) else [value])
+		rows[kind].append(row)
+
+	for kind in KINDS:
+		if kind != "mesh":
+			width = sum(1 if column == "radius" else 3 for column in KINDS[kind])
+			arrays[kind] = array(rows[kind], dtype=float64).reshape(-1, width)
+		arrays[kind + "_material"] = array(materials[kind], dtype=int32)
+	arrays["order"] = array(order, dtype=int32).reshape(-1, 2)
+	arrays["materials"] = _bytes(json.dumps(specs))
+	arrays["vertices"] = _concatenate(vertices, (0, 3), float64)
+	arrays["faces"] = _concatenate(faces, (0, 3), int32)
+	arrays["meshes"] = array(meshes, dtype=int32).reshape(-1, 4)
+	arrays["meshfiles"] = _bytes(json.dumps(meshfiles))
+	arrays["meshstats"] = _bytes(_meshstats(json.dumps(meshfiles)))
+	return arrays
+
+
+def build(arrays: dict, res=(200, 200)) -> tuple:
+	# scene objects out of the packed arrays
+	c = arrays["camera"].tolist()
+	camera = Camera(Vector(c[0:3]), Vector(c[3:6]), Vector(c[6:9]), _number(c[9]), res=res)
+	lights = [Light(Vector(l[0:3]), Color(l[3:6]), intensity=_number(l[6]), falloff=_number(l[7]) or None)
+			  for l in arrays["lights"].tolist()]
+
+	materials = []
+	for spec in json.loads(_text(arrays["materials"])):
+		materials.append(makematerial(spec, materials))
+
+	objects = []
+	for kind, row in arrays["order"].tolist():
+		kind = list(KINDS)[kind]
+		material = materials[int(arrays[kind + "_material"][row])]
+		if kind == "mesh":
+			v_start, f_start, v_count, f_count = arrays["meshes"][row].tolist()
+			objects.append(TriangleMesh(arrays["vertices"][v_start:v_start + v_count],
+										arrays["faces"][f_start:f_start + f_count], material))
+			continue
+		values = arrays[kind][row].tolist()
+		if kind == "sphere":
+			objects.append(Sphere(Vector(values[0:3]), _number(values[3]), material))
+		elif kind == "plane":
+			objects.append(Plane(Vector(values[0:3]), Vector(values[3:6]), material))
+		else:
+			objects.append(Triangle(Vector(values[0:3]), Vector(values[3:6]), Vector(values[6:9]), material=material))
+	return camera, lights, objects
+
+
+def makematerial(spec: dict, materials: list):
+	# materials holds the ones made before, a checkerboard refers to its two by index
+	if "builtin" in spec:
+		return materialsContainer[spec["builtin"]]
+	levels = dict(ambLvl=spec.get("ambient", .4), diffLvl=spec.get("diffuse", .9),
+				  specLvl=spec.get("specular", .0), surface=spec.get("surface", 30))
+	if "checkerboard" in spec:
+		checker = spec["checkerboard"]
+		# CheckerBoard sets the levels of both materials, copies keep the others as they are
+		first, second = (materials[checker[key]].copy() for key in ("first", "second"))
+		return CheckerBoard(first, second, size=checker.get("size", 10), **levels)
+	return Material(Color(spec.get("color", (175, 175, 175))), **levels)
+
+
+def _number(value: float):
+	# whole numbers come back as int, like they were written
+	return int(value) if float(value).is_integer() else value
+
+
+def _meshstats(meshfiles: str) -> str:
+	# size and modification time of every mesh file; a changed mesh invalidates the cache
+	stats = []
+	for fname in json.loads(meshfiles):
+		try:
+			info = stat(fname)
+			stats.append([info.st_size, info.st_mtime_ns])
+		except OSError:
+			stats.append(None)
+	return json.dumps(stats)
+
+
+def _concatenate(parts: list, shape: tuple, kind):
+	if not parts:
+		return empty(shape, dtype=kind)
+	return concatenate(parts)
+
+
+def _bytes(text: str):
+	return frombuffer(text.encode(), dtype=uint8)
+
+
+def _text(data) -> str:
+	return data.tobytes().decode()
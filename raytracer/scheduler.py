@@ -0,0 +1,199 @@
+import multiprocessing
+from multiprocessing import Process, Queue
+from queue import Empty
+from time import perf_counter, time
+from traceback import format_exc
+
+from numpy import arange, meshgrid
+
+from raytracer.instruments import mergecounters
+
+_POLL = 1.  # seconds between looking for dead workers while waiting for results
+
+
+def maketiles(resW: int, resH: int, size: int, top=0) -> list:
+	# (x_start, y_start, x_end, y_end) with exclusive ends, row by row, from row top on
+	return [
+		(x, y, min(x + size, resW), min(y + size, resH))
+		for y in range(top, resH, size)
+		for x in range(0, resW, size)
+	]
+
+
+def tilepixels(tile: tuple, step=1, skip=0):
+	# pixels of the tile on the grid of every step-th pixel, leaving out those
+	# on the coarser grid of every skip-th pixel (rendered by an earlier pass)
+	x_start, y_start, x_end, y_end = tile
+	xs, ys = meshgrid(arange(x_start, x_end), arange(y_start, y_end), indexing="ij")
+	xs, ys = xs.ravel(), ys.ravel()
+
+	if step > 1:
+		ongrid = (xs % step == 0) & (ys % step == 0)
+		xs, ys = xs[ongrid], ys[ongrid]
+	if skip:
+		fresh = (xs % skip != 0) | (ys % skip != 0)
+		xs, ys = xs[fresh], ys[fresh]
+	return xs, ys
+
+
+def refinements(step: int) -> list:
+	# (step, skip) of every progressive pass, coarse to fine; step is rounded down to a power of two
+	if step <= 1:
+		return [(1, 0)]
+	step = 1 << (step.bit_length() - 1)
+	passes = [(step, 0)]
+	while step > 1:
+		passes.append((step // 2, step))
+		step //= 2
+	return passes
+
+
+class TileScheduler:
+	"""
+	Hands out small tiles from a shared queue to a pool of persistent worker
+	processes, so that cheap tiles (empty sky) and expensive ones (reflective
+	spheres) even out across the workers. The pool stays up between start()
+	and stop(), any number of run() calls can go through it. A tile that
+	raises in its worker, or a worker that dies, fails the run() with a
+	RuntimeError instead of leaving it waiting.
+	"""
+
+	# magic
+
+	def __init__(self, compute, processes=4, tilesize=16, collect=None):
+		self.compute = compute  # compute(tile, *args), stores the pixels itself
+		self.collect = collect  # collect() -> {group: {name: count}}, runs in each worker when it stops
+		self.processes = processes
+		self.tilesize = tilesize
+		self.workers = []
+		self.stats = {}
+		self.counters = {}
+		self._tasks, self._results = None, None
+
+	def __str__(self):
+		return "TileScheduler({}, {})".format(self.processes, self.tilesize)
+
+	__repr__ = __str__
+
+	# behaviour
+
+	def start(self):
+		self._tasks, self._results = Queue(), Queue()
+		self.workers = [
+			Process(target=self.work, args=(self._tasks, self._results), name="render-worker-{}".format(i))
+			for i in range(self.processes)
+		]
+		self.stats = {w.name: {"tiles": 0, "busy": .0, "idle": .0, "tail": .0} for w in self.workers}
+		self.stats["total"] = {"tiles": 0, "time": .0}
+		self.counters = {}
+
+		for w in self.workers: w.start()
+		return self
+
+	def run(self, resW: int, resH: int, *args, scale=1, top=0, exclude=None):
+		# calls compute(tile, *args) for every tile of the frame from row top on, returns when all
+		# are done; sparse passes scale the tiles up, so that a tile holds about as many pixels as usual.
+		# exclude(tile, args) -> True leaves a tile out
+		tiles = maketiles(resW, resH, self.tilesize * scale, top=top)
+		if exclude:
+			tiles = [tile for tile in tiles if not exclude(tile, args)]
+		start = time()
+		for tile in tiles:
+			self._tasks.put((tile, args))
+
+		finished = {}
+		try:
+			for _ in tiles:
+				kind, name, payload = self.result()
+				finished[name] = payload
+		except RuntimeError:
+			self.drain()  # the other workers need not render the rest of the frame
+			raise
+		end = time()
+
+		for name in self.stats:
+			if name != "total":
+				# time between a worker running dry and the last tile being finished
+				self.stats[name]["tail"] += end - finished.get(name, start)
+		self.stats["total"]["tiles"] += len(tiles)
+		self.stats["total"]["time"] += end - start
+
+	def stop(self):
+		for _ in self.workers:
+			self._tasks.put(None)  # one stop signal per worker
+
+		# workers that failed before send no stats; tiles of a failed run may still come in
+		waiting = {w.name for w in self.workers if w.is_alive()}
+		while waiting:
+			try:
+				kind, name, payload = self._results.get(timeout=_POLL)
+			except Empty:
+				waiting &= {w.name for w in self.workers if w.is_alive()}
+				continue
+			if kind == "stats":
+				mergecounters(self.counters, payload.pop("counters"))
+				self.stats[name].update(payload)
+				waiting.discard(name)
+
+		for w in self.workers: w.join()
+		self.workers = []
+
+	def result(self) -> tuple:
+		# next (kind, name, payload) of the workers; RuntimeError if a tile raised or a worker died
+		while True:
+			try:
+				kind, name, payload = self._results.get(timeout=_POLL)
+			except Empty:
+				dead = [w for w in self.workers if not w.is_alive()]
+				if dead and self._results.empty():
+					raise RuntimeError("{} died with exit code {}".format(dead[0].name, dead[0].exitcode))
+				continue
+			if kind == "error":
+				raise RuntimeError("{} failed on a tile:\n{}".format(name, payload))
+			return kind, name, payload
+
+	def drain(self):
+		# takes back the tiles no worker has started on yet
+		try:
+			while True:
+				self._tasks.get(timeout=.1)
+		except Empty:
+			pass
+
+	def work(self, tasks: Queue, results: Queue):
+		name = multiprocessing.current_process().name
+		tiles, busy, idle = 0, .0, .0
+
+		while True:
+			waiting = perf_counter()
+			task = tasks.get()
+			started = perf_counter()
+			idle += started - waiting
+
+			if task is None:
+				break
+
+			tile, args = task
+			try:
+				self.compute(tile, *args)
+			except Exception:
+				results.put(("error", name, format_exc()))
+				return
+			busy += perf_counter() - started
+			tiles += 1
+			results.put(("tile", name, time()))
+
+		counters = self.collect() if self.collect else {}
+		results.put(("stats", name, {"tiles": tiles, "busy": busy, "idle": idle, "counters": counters}))
+
+	def report(self) -> str:
+		lines = []
+		for name, stat in self.stats.items():
+			if name == "total":
+				continue
+			lines.append("> {}: {} tiles, busy {:.3f}s, idle {:.3f}s, tail {:.3f}s".format(
+					name, stat["tiles"], stat["busy"], stat["idle"], stat["tail"]))
+		total = self.stats.get("total")
+		if total:
+			lines.append("> {} tiles of {}px in {:.3f}s".format(total["tiles"], self.tilesize, total["time"]))
+		return "\n".join(lines)
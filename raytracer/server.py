@@ -0,0 +1,195 @@
+import json
+import re
+import sys
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from itertools import count
+from multiprocessing import Process
+from queue import Queue
+from threading import Event, Lock, Thread
+from time import perf_counter
+
+from raytracer.distributed import Coordinator, work
+from raytracer.framebuffer import Framebuffer
+
+_FORMATS = {"png": ("PNG", "image/png"), "jpeg": ("JPEG", "image/jpeg"), "ppm": ("PPM", "image/x-portable-pixmap")}
+
+# the options a job may set; everything touching files, processes or the network stays with the server
+JOBOPTIONS = {"res", "rdepth", "rthreshold", "reflection", "tonemap", "aa", "aathreshold", "aasamples", "batched", "bvh",
+			  "instrument", "lightintensity", "lightpos", "lightcolor", "lightcutoff", "lightsamples", "spherecolors",
+			  "floormat"}
+
+
+class RenderJob:
+	__slots__ = ("id", "args", "view", "ftype", "queued", "done", "image", "error", "timings")
+
+	def __init__(self, id: int, args: list, view=None, ftype="png"):
+		self.id = id
+		self.args = args  # ArgsHandler style, ["-res=160,120", "-rdepth=2", ...]
+		self.view = view  # camera overrides, {"origin": [x, y, z], "focus": ..., "up": ..., "fov": ...}
+		self.ftype = ftype
+		self.queued = perf_counter()
+		self.done = Event()
+		self.image = None
+		self.error = None
+		self.timings = {}
+
+
+class RenderServer(ThreadingHTTPServer):
+	"""
+	Render daemon: a warm pool of worker processes, forked once with NumPy,
+	PIL and the materials imported, takes one job at a time from a queue.
+	Jobs come in over HTTP and get the encoded image back; the workers keep
+	the last scene and only rebuild it when a job changes it.
+
+		POST /render  {"args": ["-res=160,120", "-rdepth=2"], "view": {"fov": 30}, "format": "png"}
+		GET  /stats   queue latency and render time of the jobs so far
+	"""
+
+	daemon_threads = True
+
+	def __init__(self, address: tuple, build, fromsettings, processes=4, tilesize=16):
+		self.build = build  # build(args, view) -> RayTracer
+		self.jobs = Queue()
+		self.history = []
+		self._ids = count(1)
+		self._lock = Lock()
+
+		self.pool = Coordinator(address=("127.0.0.1", 0), tilesize=tilesize).listen()
+		# forked before any thread runs, the workers reconnect if they get ahead of the coordinator
+		self.workers = [Process(target=work, args=(self.pool.address, fromsettings, "warm-{}".format(i)), daemon=True)
+						for i in range(processes)]
+		for worker in self.workers: worker.start()
+		self.pool.start()
+
+		super().__init__(address, RenderHandler)
+		Thread(target=self.renderloop, name="renderloop", daemon=True).start()
+
+	def __str__(self):
+		return "RenderServer({}:{}, {} workers)".format(self.server_address[0], self.server_address[1], len(self.workers))
+
+	__repr__ = __str__
+
+	# behaviour
+
+	def submit(self, args: list, view=None, ftype="png") -> RenderJob:
+		if ftype not in _FORMATS:
+			raise ValueError("format has to be one of {}".format(", ".join(_FORMATS)))
+		for arg in args:
+			option = re.match(r"-(\w+)", arg) if isinstance(arg, str) else None
+			if not option or option.group(1) not in JOBOPTIONS:
+				raise ValueError("job option {!r} not allowed, only -{}".format(arg, ", -".join(sorted(JOBOPTIONS))))
+		if view is not None and not isinstance(view, dict):
+			raise ValueError("view has to be an object")
+		job = RenderJob(next(self._ids), args, view, ftype)
+		self.jobs.put(job)
+		return job
+
+	def renderloop(self):
+		while True:
+			job = self.jobs.get()
+			started = perf_counter()
+			job.timings["queue"] = started - job.queued
+			try:
+				job.image = self.render(job)
+			except Exception as error:  # the daemon lives on, the client gets the message
+				job.error = "{}: {}".format(type(error).__name__, error)
+			job.timings["total"] = perf_counter() - started
+			self.record(job)
+			job.done.set()
+
+	def render(self, job: RenderJob) -> bytes:
+		output = StringIO()  # the tracer's reports stay out of the daemon's log
+		with redirect_stdout(output):
+			building = perf_counter()
+			tracer = self.build(job.args, job.view)
+			# the image goes back to the client, the frame renders on the warm pool
+			tracer.pool, tracer.show, tracer._export, tracer.stream = self.pool, False, False, False
+			tracer.multi, tracer.coordinator, tracer.progressive = False, None, 0
+			job.timings["build"] = perf_counter() - building
+
+			tracer.framebuffer = Framebuffer(tracer.resW, tracer.resH, tonemap=tracer.tonemap, ids=tracer.antialias)
+			tracer.castrays()
+			job.timings.update(tracer.timings)
+
+		encoding = perf_counter()
+		buffer = BytesIO()
+		tracer.framebuffer.toimage().save(buffer, _FORMATS[job.ftype][0])
+		job.timings["encode"] = perf_counter() - encoding
+		job.timings["pixels"] = tracer.resW * tracer.resH
+		return buffer.getvalue()
+
+	def record(self, job: RenderJob):
+		entry = dict(job.timings, id=job.id, error=job.error)
+		with self._lock:
+			self.history.append(entry)
+		print("> job {}: queued {:.3f}s, rendered in {:.3f}s{}".format(
+				job.id, job.timings["queue"], job.timings["total"], " ({})".format(job.error) if job.error else ""),
+			file=sys.stderr)
+
+	def stats(self) -> dict:
+		with self._lock:
+			history = list(self.history)
+
+		def summary(key):
+			values = [entry[key] for entry in history if key in entry]
+			if not values:
+				return None
+			return {"mean": sum(values) / len(values), "max": max(values), "last": values[-1]}
+
+		return {
+			"jobs": len(history),
+			"failed": sum(1 for entry in history if entry["error"]),
+			"queued": self.jobs.qsize(),
+			"workers": self.pool.workers,
+			"queue_s": summary("queue"),
+			"render_s": summary("total"),
+			"recent": history[-20:],
+		}
+
+	def server_close(self):
+		super().server_close()
+		self.pool.stop()
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		if self.path.rstrip("/") != "/stats":
+			return self.reply(404, {"error": "unknown path {}".format(self.path)})
+		self.reply(200, self.server.stats())
+
+	def do_POST(self):
+		if self.path.rstrip("/") != "/render":
+			return self.reply(404, {"error": "unknown path {}".format(self.path)})
+		try:
+			body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+			job = self.server.submit(list(body.get("args", [])), body.get("view"), body.get("format", "png").lower())
+		except (ValueError, AttributeError) as error:
+			return self.reply(400, {"error": str(error)})
+
+		job.done.wait()
+		if job.error:
+			return self.reply(500, {"error": job.error, "id": job.id})
+
+		self.send_response(200)
+		self.send_header("Content-Type", _FORMATS[job.ftype][1])
+		self.send_header("Content-Length", str(len(job.image)))
+		self.send_header("X-Job-Id", str(job.id))
+		self.send_header("X-Queue-Seconds", "{:.6f}".format(job.timings["queue"]))
+		self.send_header("X-Render-Seconds", "{:.6f}".format(job.timings["total"]))
+		self.send_header("X-Timings", json.dumps(job.timings))
+		self.end_headers()
+		self.wfile.write(job.image)
+
+	def reply(self, status: int, content: dict):
+		data = json.dumps(content).encode()
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, format, *args):
+		pass  # one line per job comes from RenderServer.record
@@ -0,0 +1,105 @@
+from numpy import array, float64, full, int64, maximum, ndarray, sqrt
+
+from raytracer.objects import Material, isTexture, rowdot
+
+# shading of whole batches of hits, struct of arrays: (N, 3) points, normals and ray
+# directions plus (N,) material rows. Every step repeats the float operations of the
+# scalar path (Vector.reflect, RayTracer.com_directlight, Material.calccolor) in the same
+# order, so a batched render gives the same pixels as a scalar one.
+
+_SHADOW = .8  # Material.calcshaded
+
+
+class MaterialTable:
+	"""
+	The materials of the scene's objects packed into arrays, one row per
+	material: colors (M, 3) and the ambient, diffuse, specular and surface
+	levels (M,). A texture gets one row per material it picks from; rows()
+	samples the textures of a batch of hits in one call per texture.
+	"""
+
+	# magic
+
+	def __init__(self, objects: list):
+		self.materials = []  # row -> Material
+		self._rowof = {}  # id(material) -> row
+		self.objectrows = full(len(objects), -1, dtype=int64)  # -1 for textured objects
+		self.textures = {}  # object index -> (texture, rows of texture.materials())
+
+		for idx, obj in enumerate(objects):
+			material = obj.material
+			if isinstance(material, isTexture):
+				self.textures[idx] = (material, array([self.row(m) for m in material.materials()], dtype=int64))
+			else:
+				self.objectrows[idx] = self.row(material)
+
+		self.colors = array([m.color.rgb for m in self.materials], dtype=float64).reshape(-1, 3)
+		self.ambient = array([m.ambLvl for m in self.materials], dtype=float64)
+		self.diffuse = array([m.diffLvl for m in self.materials], dtype=float64)
+		self.specular = array([m.specLvl for m in self.materials], dtype=float64)
+		self.surface = array([m.surface for m in self.materials])
+
+	def __str__(self):
+		return "MaterialTable({} materials, {} textures)".format(len(self.materials), len(self.textures))
+
+	__repr__ = __str__
+
+	def __len__(self):
+		return len(self.materials)
+
+	# behaviour
+
+	def row(self, material: Material) -> int:
+		if id(material) not in self._rowof:
+			self._rowof[id(material)] = len(self.materials)
+			self.materials.append(material)
+		return self._rowof[id(material)]
+
+	def rows(self, indices: ndarray, points: ndarray) -> ndarray:
+		# (N,) material rows of hits on the objects indices at points
+		rows = self.objectrows[indices]
+		for idx, (texture, texturerows) in self.textures.items():
+			on = (indices == idx).nonzero()[0]
+			if len(on):
+				picked, _ = texture.sample(points[on])
+				rows[on] = texturerows[picked]
+		return rows
+
+
+def normalized(vectors: ndarray) -> ndarray:
+	# Vector.normalized row by row
+	return vectors / sqrt(rowdot(vectors, vectors))[:, None]
+
+
+def reflect(vectors: ndarray, axes: ndarray) -> ndarray:
+	# Vector.reflect row by row, the axes normalized again like there
+	axes = normalized(axes)
+	d = rowdot(vectors, axes)[:, None]
+	return vectors - 2 * axes * d
+
+
+def phong(table: MaterialTable, rows: ndarray, points: ndarray, normals: ndarray, directions: ndarray,
+		  lightorigin: ndarray, intensity: float) -> ndarray:
+	# (N, 3) radiance of unshadowed hits: ambient, diffuse and specular term in one pass
+	return table.colors[rows] * phonglevels(table, rows, points, normals, directions, lightorigin, intensity)[:, None]
+
+
+def phonglevels(table: MaterialTable, rows: ndarray, points: ndarray, normals: ndarray, directions: ndarray,
+				lightorigins: ndarray, intensities) -> ndarray:
+	# (N,) Material.calclevel, a light origin and intensity per row or one for all
+	tolight = normalized(lightorigins - points)
+	tolight_r = normalized(reflect(tolight, normals))
+
+	phi = rowdot(tolight, normals)  # <l, n>
+	theta = rowdot(tolight_r, -1 * directions)  # <lr, -d>
+
+	# light facing away contributes nothing instead of darkening
+	level = table.ambient[rows]
+	level = level + table.diffuse[rows] * maximum(phi, .0)
+	level = level + table.specular[rows] * (maximum(theta, .0) ** table.surface[rows])
+	return level * intensities
+
+
+def shadowed(table: MaterialTable, rows: ndarray) -> ndarray:
+	# (N, 3) radiance of hits in shadow
+	return table.colors[rows] * _SHADOW
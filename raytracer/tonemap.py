@@ -0,0 +1,20 @@
+from numpy import ndarray, uint8
+
+# tone mapping operators: (N, 3) float radiance on the 0..255 scale of Color -> (N, 3) uint8
+
+
+def clamp(rgb: ndarray) -> ndarray:
+	# what Color.check did per operation, now once per pixel
+	return rgb.clip(0, 255).astype(uint8)
+
+
+def reinhard(rgb: ndarray, white=2.0) -> ndarray:
+	# extended Reinhard per channel; radiance of white * 255 maps to full brightness
+	x = rgb.clip(0, None) / 255
+	return clamp(x * (1 + x / (white * white)) / (1 + x) * 255)
+
+
+tonemaps = {
+	"clamp": clamp,
+	"reinhard": reinhard,
+}
@@ -1,41 +1,64 @@
-import multiprocessing
+import pickle
 from datetime import datetime
-from multiprocessing import Manager, Process
+from multiprocessing import Process
+from socket import gethostname
 from sys import argv
+from time import perf_counter
 
+from numpy import arange, concatenate, empty, full, inf, int64, ndarray, outer, searchsorted, sqrt, unique, zeros
 from PIL import Image
 
+from raytracer.animation import Animation
+from raytracer.antialias import gridsize, subsamples
 from raytracer.argumentHandler import ArgsHandler
+from raytracer.bvh import BVH
+from raytracer.checkpoint import Checkpoint
 from raytracer.coloring import *
-from raytracer.objects import Camera, HitPointData, Light, Plane, Ray, Sphere, Triangle, Vector
+from raytracer.distributed import Coordinator, parseaddress, work
+from raytracer.framebuffer import Framebuffer
+from raytracer.gbuffer import GBuffer, geometrykey
+from raytracer.imagewriter import WRITERS, imageformat, writeimage
+from raytracer.instruments import Instruments, mergecounters
+from raytracer.lights import LightSet
+from raytracer.mesh import TriangleMesh
+from raytracer.renderlog import appendrecord, scenehash, usage
+from raytracer.objects import Camera, HitPointData, Light, Plane, Radiance, Ray, Sphere, Triangle, Vector, rowdot
+from raytracer.scenefile import SceneFile
+from raytracer.scheduler import TileScheduler, maketiles, refinements, tilepixels
+from raytracer.server import RenderServer
+from raytracer.shading import MaterialTable, normalized, phonglevels, reflect, shadowed
+from raytracer.tonemap import clamp, tonemaps
+
+
+_PAIRS = 1 << 20  # (hit, light) pairs shaded at once, see lightpairs
 
 
 class RayTracer:
 
 	# DONE
 	def export(self, start, end):
-		self.image = Image.new("RGB", (self.resW, self.resH))
-
 		duration = end - start
-		time1 = "-".join([str(start.year), str(start.month), str(start.day)])
-		time2 = ":".join([str(start.year), str(start.hour), str(start.minute)])
-		directory = "./renders/"
-		fname = "{}_{}-fov{}-res{}x{}".format(time1, time2, str(self.camera.fov), str(self.resW), str(self.resH))
+		directory = self.directory
 
 		# image
-		img_fname = directory + fname + ".jpg"
+		img_fname = self.imagename()
 
 		print("\nWriting to image.")
 
-		for xy, color in self.pixels:
-			self.image.putpixel(xy, color)
+		if not self.stream:  # a streamed image is on disk already, the framebuffer only holds its last rows
+			self.image = self.framebuffer.toimage()
 
 		if self._export:
 			from os import path, mkdir
 			if not path.isdir(directory):
 				mkdir(directory)
 
-			self.image.save(img_fname, "JPEG", quality=99)
+			if self.stream:
+				pass
+			elif self.ftype in WRITERS:
+				writeimage(img_fname, self.framebuffer.data, self.ftype)
+			else:
+				self.image.save(img_fname, self.format, quality=99)
 
 			print("Exported => {}\n".format(path.abspath(img_fname)))
 
@@ -62,10 +85,18 @@ class RayTracer:
 				file.write("max depth level: {}".format(str(self.maxlevel)))
 				file.write("\n")
 
-				file.write("camera: {}".format(str(self.objects)))
+				file.write("reflection threshold: {}".format(str(self.rthreshold)))
+				file.write("\n")
+
+				file.write("reflection rays: {} traced, {} saved".format(
+						self.counters["shade"]["reflections"],
+						self.counters["shade"]["shadowed"] + self.counters["shade"]["negligible"]))
 				file.write("\n")
 
-				file.write("light: {}".format(str(self.camera)))
+				file.write("camera: {}".format(str(self.camera)))
+				file.write("\n")
+
+				file.write("lights: {}".format(str(self.lights)))
 				file.write("\n")
 
 				file.write("objects: {}".format(str(self.objects)))
@@ -74,80 +105,654 @@ class RayTracer:
 				file.write("\n\n")
 
 
-		self.image.show("Image")
+		if self.show and self.image:
+			self.image.show("Image")
 		return
 
+	def imagename(self) -> str:
+		extension = "jpg" if self.ftype == "jpeg" else self.ftype
+		return "{}{}.{}".format(self.directory, self.filename, extension)
+
+	def name(self, start: datetime) -> str:
+		time1 = "-".join([str(start.year), str(start.month), str(start.day)])
+		time2 = ":".join([str(start.year), str(start.hour), str(start.minute)])
+		return "{}_{}-fov{}-res{}x{}".format(time1, time2, str(self.camera.fov), str(self.resW), str(self.resH))
+
 	# DONE
 	def start(self):
 		start = datetime.now()
+		self.filename = self.name(start)
+		began, used = perf_counter(), usage()
+
+		fname = None
+		if self.checkpointfile:
+			fname = self.checkpointfile
+			from os import makedirs, path
+			makedirs(path.dirname(fname) or ".", exist_ok=True)
+			self.checkpoint = Checkpoint(fname + ".tiles", self.checkpointheader(), resume=self.resume)
+		self.framebuffer = Framebuffer(self.resW, self.resH, shared=bool(self.multi), tonemap=self.tonemap,
+									   ids=self.antialias, rows=self.tilesize if self.stream else None,
+									   fname=fname, resume=self.checkpoint is not None and self.checkpoint.resumed)
+		if self.checkpoint:
+			if self.checkpoint.resumed and not self.framebuffer.resumed:
+				raise ValueError("{} is missing or damaged, {} cannot be resumed".format(fname, self.checkpoint.fname))
+			print("> checkpoint {}: {} tiles done before".format(fname, len(self.checkpoint.done)))
+		if self.stream:
+			from os import makedirs
+			makedirs(self.directory, exist_ok=True)
+			self.writer = WRITERS[self.ftype](self.imagename(), self.resW, self.resH)
+		try:
+			self.castrays()
+
+			end = datetime.now()
+			print("Time needed:", end - start)
+			exporting = perf_counter()
+			self.export(start, end)
+			self.timings["export"] = perf_counter() - exporting
+			print(self.stagereport())
+
+			if self.renderlog or self._export:
+				self.logrender(start, perf_counter() - began, used)
+		finally:
+			self.framebuffer.close()
+			self.release()
+
+		if self.checkpoint:  # finished, nothing left to resume
+			from os import remove
+			remove(self.checkpointfile)
+			self.checkpoint.remove()
+			self.checkpoint = None
+
+	def animate(self):
+		# every frame of the animation into a numbered image; the framebuffer, the workers and
+		# the BVH are set up once, a frame only moves the camera and the light
+		start = datetime.now()
+		self.filename = self.name(start)
+		began, used = perf_counter(), usage()
+		frames, refined, timings = len(self.animation), 0, {}
+
+		from os import makedirs
+		makedirs(self.directory, exist_ok=True)
+		self.framebuffer = Framebuffer(self.resW, self.resH, shared=bool(self.multi), tonemap=self.tonemap,
+									   ids=self.antialias)
+		if not self.coordinator:
+			self.prepare()
+		local = self.startscheduler()
+		try:
+			for frame in range(frames):
+				rendering = perf_counter()
+				self.setframe(frame)
+				self.framebuffer.clear()
+				self.castpixels()
+				refined += self.refined
+				fname = self.writeframe(frame)
+				for stage, spent in self.timings.items():
+					timings[stage] = timings.get(stage, .0) + spent
+				print("> frame {} of {} in {:.3f}s => {}".format(frame + 1, frames, perf_counter() - rendering, fname))
+		finally:
+			self.stopscheduler(local)
+			self.framebuffer.close()
+			self.release()
+
+		self.refined, self.timings = refined, timings
+		if self.scheduler:
+			mergecounters(self.counters, self.scheduler.counters)
+		if self.bvh:
+			print(self.bvh.report())
+		print(self.shadowreport())
+		print(self.shadereport())
+		if self.antialias:
+			print(self.aareport())
+		if self.instrument:
+			print(Instruments.report(self.counters))
+
+		wall = perf_counter() - began
+		print("> {} frames in {:.3f}s, {:.2f} frames per minute".format(frames, wall, frames / wall * 60))
+		if self.renderlog or self._export:
+			self.logrender(start, wall, used)
+
+	def setlights(self, lights: list):
+		self.lights = lights
+		self.light = lights[0]  # the one an animation moves
+		self.lightset = LightSet(lights, self.lightcutoff, self.lightsamples)
+
+	def setframe(self, frame: int):
+		# camera and light of the animation's frame
+		self.camera, light = self.animation.frame(frame, (self.resW, self.resH))
+		self.setlights([light] + self.lights[1:])
+		self.pxWidth = self.camera.width / (self.resW - 1)
+		self.pxHeigth = self.camera.height / (self.resH - 1)
+		self.frame = frame
 
-		self.castrays()
-
-		end = datetime.now()
-		print("Time needed:", end - start)
-		self.export(start, end)
+	def writeframe(self, frame: int) -> str:
+		name, extension = self.imagename().rsplit(".", 1)
+		fname = "{}-{:04d}.{}".format(name, frame, extension)
+		if self.ftype in WRITERS:
+			writeimage(fname, self.framebuffer.data, self.ftype)
+		else:
+			self.framebuffer.toimage().save(fname, self.format, quality=99)
+		return fname
+
+	def checkpointheader(self) -> dict:
+		# everything a resumed render has to share with the killed one to give the same image
+		return {
+			"scene": scenehash(self.camera, self.lights, self.objects),
+			"resolution": [self.resW, self.resH],
+			"maxlevel": self.maxlevel,
+			"reflection": self.reflection,
+			"rthreshold": self.rthreshold,
+			"tilesize": self.tilesize,
+			"progressive": self.progressive,
+			"antialias": [self.antialias, self.aathreshold, self.aasamples],
+			"lights": [self.lightcutoff, self.lightsamples],
+			"tonemap": self.tonemap.__name__,
+		}
+
+	def logrender(self, start: datetime, wall: float, used: dict):
+		# one JSON line per render, -renderlog or render-log.jsonl next to the text log
+		fname = self.renderlog
+		if not fname:
+			from os import makedirs
+			makedirs(self.directory, exist_ok=True)
+			fname = self.directory + "render-log.jsonl"
+
+		now = usage()
+		rays = self.raycount()
+		record = {
+			"date": start.isoformat(timespec="seconds"),
+			"image": self.imagename() if self._export or self.stream else None,
+			"scene": scenehash(self.camera, self.lights, self.objects),
+			"width": self.resW,
+			"height": self.resH,
+			"depth": self.maxlevel,
+			"processes": self.multi or 1,
+			"lights": len(self.lights),
+			"lightsamples": self.lightsamples,
+			"batched": self.batched,
+			"bvh": self.accelerate,
+			"antialias": self.antialias,
+			"progressive": self.progressive,
+			"tonemap": self.tonemap.__name__,
+			"wall_s": wall,
+			"cpu_s": now["cpu"] - used["cpu"],
+			"rays": sum(rays.values()),
+			"rays_per_s": sum(rays.values()) / wall if wall else .0,
+			"peak_rss_mb": now["rss"],
+			"peak_rss_worker_mb": now["rss_children"] if self.multi else None,
+		}
+		if self.animation:
+			record["frames"] = len(self.animation)
+			record["frames_per_min"] = len(self.animation) / wall * 60 if wall else .0
+			record["image"] = "{}-%04d.{}".format(*self.imagename().rsplit(".", 1))
+		for kind, count in rays.items():
+			record["rays_" + kind] = count
+		for stage, spent in self.timings.items():
+			record["stage_{}_s".format(stage)] = spent
+		for stage, spent in self.counters.get("time", {}).items():
+			record["time_{}_s".format(stage)] = spent
+		appendrecord(fname, record)
+
+	def raycount(self) -> dict:
+		# rays by kind; without instruments the primary rays are worked out from the pixels
+		if "rays" in self.counters:
+			return dict(self.counters["rays"])
+		primary = self.resW * self.resH * (len(self.animation) if self.animation else 1)
+		if self.antialias:
+			primary += self.refined * gridsize(self.aasamples) ** 2
+		return {
+			"primary": primary,
+			"reflection": self.counters["shade"]["reflections"],
+			"shadow": self.counters["shadow"]["rays"],
+		}
+
+	def prepare(self):
+		# everything tracing needs besides the framebuffer, in this process
+		if self.accelerate:
+			building = perf_counter()
+			self.bvh = BVH(self.objects)
+			self.counters["bvh"] = self.bvh.counters
+			self.timings["bvh"] = perf_counter() - building
+		self.indexof = {id(obj): idx for idx, obj in enumerate(self.objects)}
+		if self.batched or self.relight:
+			self.materialtable = MaterialTable(self.objects)
+		if self.instrument and self.instruments is None:
+			self.instruments = Instruments(self).attach()
+
+	def release(self):
+		# takes the instruments off again, their wrappers sit on objects and textures
+		# (coloring.materialsContainer) that the next tracer in this process may share
+		if self.instruments is not None:
+			self.instruments.detach()
+			self.instruments = None
 
 	def castrays(self):
-		if not self.multi:
-			for x in range(self.resW):
-				for y in range(self.resH):
-					self.compute(x, y)
-			return
-
-		part_width = int(self.resW / self.multi)
-		parts = [[part_width * p - part_width, part_width * p - 1] for p in range(1, self.multi + 1)]
-		parts[-1][-1] = self.resW - 1
+		if not (self.coordinator or self.pool):  # the workers prepare themselves from the pickled settings
+			self.prepare()
+
+		self.castpixels()
+
+		if self.scheduler:
+			# the workers did the tracing, their counts are summed up into the (untouched) ones here
+			mergecounters(self.counters, self.scheduler.counters)
+
+		if self.bvh:
+			print(self.bvh.report())
+		print(self.shadowreport())
+		print(self.shadereport())
+		if self.antialias:
+			print(self.aareport())
+		if self.instrument:
+			print(Instruments.report(self.counters))
+
+	def castpixels(self):
+		passes = refinements(self.progressive)
+
+		# a scheduler started before (by animate) stays up for the next frame
+		local, owned = [], self.scheduler is None
+		if self.pool:
+			mark = None
+			if self.checkpoint:
+				mark = lambda tile, args: self.checkpoint.mark(self.tilekey(tile, *args))
+			self.scheduler = self.pool.setscene(self.framebuffer, pickle.dumps(self.settings()), mark=mark)
+		elif owned:
+			local = self.startscheduler()
+		try:
+			rendering = perf_counter()
+			if self.relight:
+				self.relightframe()
+			else:
+				for number, (step, skip) in enumerate(passes):
+					if self.stream:
+						self.castbands()
+					else:
+						self.castjob("render", step, skip, scale=step)
+					if len(passes) > 1:
+						self.writepass(number, step)
+			self.timings["render"] = perf_counter() - rendering
+
+			if self.antialias:
+				# the edges are found once the whole frame is there, then only they get more samples
+				refining = perf_counter()
+				if self.checkpoint and "edges" in self.checkpoint:  # the refined pixels have changed since
+					self.refined = int(self.framebuffer.edges.sum())
+				else:
+					self.refined = self.framebuffer.markedges(self.aathreshold)
+					if self.checkpoint:
+						self.checkpoint.mark("edges")
+				self.castjob("refine")
+				self.timings["antialias"] = perf_counter() - refining
+		finally:
+			if owned:
+				self.stopscheduler(local)
+
+	def startscheduler(self) -> list:
+		# the TileScheduler or the Coordinator, if any; returns the local worker processes to join
+		local, mark = [], None
+		if self.checkpoint:
+			mark = lambda tile, args: self.checkpoint.mark(self.tilekey(tile, *args))
+		if self.coordinator:
+			self.scheduler = Coordinator(self.framebuffer, pickle.dumps(self.settings()), parseaddress(self.coordinator),
+										 tilesize=self.tilesize, mark=mark).listen()
+			# forked before the coordinator's threads start
+			local = [Process(target=work, args=(self.scheduler.address, RayTracer.fromsettings, "local-{}".format(i)))
+					 for i in range(self.localworkers)]
+			for worker in local: worker.start()
+			self.scheduler.start()
+		elif self.multi:
+			self.scheduler = TileScheduler(self.compute_tile, processes=self.multi,
+										   tilesize=self.tilesize, collect=self.collect).start()
+		return local
+
+	def stopscheduler(self, local: list):
+		if self.scheduler and not self.pool:
+			self.scheduler.stop()
+		if self.scheduler:
+			print(self.scheduler.report())
+		for worker in local: worker.join()
+
+	def castjob(self, job: str, *args, scale=1, top=0, bottom=None):
+		# the job on every tile between the rows top and bottom (the whole frame by default);
+		# with a checkpoint the tiles done before are left out
+		bottom = bottom or self.resH
+		if self.animation:  # the workers go to the frame themselves; step and skip are filled in before it
+			args = args + (1, 0)[len(args):] + (self.frame,)
+		if self.scheduler:
+			exclude = None
+			if self.checkpoint:
+				exclude = lambda tile, args: self.tilekey(tile, *args) in self.checkpoint
+			self.scheduler.run(self.resW, bottom, job, *args, scale=scale, top=top, exclude=exclude)
+		else:
+			# tile by tile here as well, so that memory does not grow with the frame
+			for tile in maketiles(self.resW, bottom, self.tilesize * scale, top=top):
+				if not self.checkpoint or self.tilekey(tile, job, *args) not in self.checkpoint:
+					self.compute_tile(tile, job, *args)
+
+	def settings(self) -> dict:
+		# constructor arguments of a tracer that renders the same pixels, for the workers
+		return dict(camera=self.camera, lights=self.lights, objects=self.objects, res=(self.resW, self.resH),
+					maxlevel=self.maxlevel, reflection=self.reflection, rthreshold=self.rthreshold,
+					batched=self.batched, tilesize=self.tilesize, accelerate=self.accelerate, tonemap=self.tonemap,
+					antialias=self.antialias, aathreshold=self.aathreshold, aasamples=self.aasamples,
+					instrument=self.instrument, animation=self.animation, lightcutoff=self.lightcutoff,
+					lightsamples=self.lightsamples)
+
+	@classmethod
+	def fromsettings(cls, settings: dict):
+		return cls(show=False, **settings)
+
+	@staticmethod
+	def tilekey(tile: tuple, job: str, step=1, skip=0) -> str:
+		return " ".join(map(str, (job,) + tuple(tile) + (step, skip)))
+
+	def castbands(self):
+		# renders the frame in bands of framebuffer.rows rows, each band is written to the
+		# image file before the next one starts, so memory does not grow with the frame
+		try:
+			for top in range(0, self.resH, self.framebuffer.rows):
+				bottom = min(top + self.framebuffer.rows, self.resH)
+				self.castjob("render", top=top, bottom=bottom)
+				self.writer.writerows(self.framebuffer.data[:bottom - top])
+			self.writer.close()
+		finally:
+			self.writer = None
+
+	def writepass(self, number: int, step: int):
+		# preview of a progressive pass; pixels not rendered yet repeat the one up left on the grid
+		rows = arange(self.resH) // step * step
+		cols = arange(self.resW) // step * step
+		preview = Image.fromarray(self.framebuffer.data[rows][:, cols])
+
+		from os import path, makedirs
+		makedirs(self.directory, exist_ok=True)
+		fname = "{}{}-pass{}-{}px.png".format(self.directory, self.filename, number, step)
+		preview.save(fname)
+		print("> pass {} every {}px => {}".format(number, step, path.abspath(fname)))
+
+	def compute_tile(self, tile: tuple, job: str, step=1, skip=0, frame=None):
+		# one tile of a pass ("render") or of the antialiasing pass ("refine"), of an animation's frame
+		if frame is not None and frame != self.frame:
+			self.setframe(frame)
+		if job == "refine":
+			x_start, y_start, x_end, y_end = tile
+			ys, xs = self.framebuffer.edges[y_start:y_end, x_start:x_end].nonzero()
+			self.refine_pixels(xs + x_start, ys + y_start)
+		else:
+			self.compute_pixels(*tilepixels(tile, step, skip))
 
-		processes = []
-		i = 0
+		if self.checkpoint:  # the pixels are in the mapped file by now
+			self.checkpoint.mark(self.tilekey(tile, job, step, skip))
 
-		values_pixels = []
-		length = self.resH
+	# DONE
+	def compute_pixels(self, xs, ys):
+		# in a worker process the framebuffer is shared with the parent
+		self.framebuffer.putarrays(xs, ys, *self.compute_arrays(xs, ys))
+
+	def compute_arrays(self, xs, ys) -> tuple:
+		# (N, 3) radiance and (N,) index of the object seen (-1 for none) of a ray through each
+		# image position, straight into arrays
+		if self.batched:
+			return self.compute_batch(xs, ys)
+		colors, indices = empty((len(xs), 3)), empty(len(xs), dtype=int64)
+		for i, (x, y) in enumerate(zip(xs.tolist(), ys.tolist())):
+			_, colors[i], indices[i] = self.compute(x, y)
+		return colors, indices
+
+	def refine_pixels(self, xs, ys):
+		# supersamples the given pixels on a jittered grid and blends the samples into them
+		if not len(xs):
+			return
+		side = gridsize(self.aasamples)
+		sx, sy = subsamples(xs, ys, side)
+		if not self.checkpoint:
+			samples = self.sample(sx, sy)
+			self.framebuffer.blend(xs, ys, samples.reshape(len(xs), side * side, 3))
+			return
 
-		lst = Manager().list()
-		for x_start, x_end in parts:
-			process = Process(target=self.compute_multi,
-							  args=(x_start, x_end, lst),
-							  name="render-part-{}".format(i))
-			processes.append(process)
-			i += 1
+		# a killed render may have blended some of the pixels already, their first sample is traced again
+		samples = self.sample(concatenate([xs, sx]), concatenate([ys, sy]))
+		first, samples = samples[:len(xs)], samples[len(xs):]
+		self.framebuffer.blend(xs, ys, samples.reshape(len(xs), side * side, 3), first=first)
 
-		for p in processes: p.start()
-		for p in processes:
-			p.join()
-			p.terminate()
+	def sample(self, xs, ys) -> ndarray:
+		# (N, 3) float radiance of a ray through each image position, fractional ones too
+		return self.compute_arrays(xs, ys)[0]
 
-		self.pixels = lst
-		return
+	def aareport(self) -> str:
+		pixels = self.resW * self.resH * (len(self.animation) if self.animation else 1)
+		side = gridsize(self.aasamples)
+		return "> antialiasing: {} of {} pixels refined ({:.1f}%), {} extra samples each, {} in total".format(
+				self.refined, pixels, 100. * self.refined / pixels, side * side, self.refined * side * side)
 
-	# DONE
-	def compute_multi(self, x_start, x_end, lst):
-		print("> started", multiprocessing.current_process().name)
+	def collect(self) -> dict:
+		# counters of a worker process, summed up by the scheduler
+		return self.counters
 
-		for x in range(x_start, x_end + 1):
-			for y in range(self.resH):
-				lst.append(self.compute(x, y))
-
-		print("> done with", x_start, x_end)
-		print(">", multiprocessing.current_process().name, "waiting for rest\n")
-		return lst
+	def stagereport(self) -> str:
+		# wall clock time of the stages in this process
+		return "> stages: " + ", ".join("{} {:.3f}s".format(stage, spent) for stage, spent in self.timings.items())
 
 	# DONE
 	def compute(self, x: int, y: int):
+		# ((x, y), radiance, index of the object seen or -1)
 		ray = self.calcray(x, y)
 
-		if not self.intersect(1, ray):  # no intersection
-			return (x, y), black.items()
+		hpd = self.intersect(1, ray)
+		if not hpd:  # no intersection
+			return (x, y), Radiance().items(), -1
+
+		# traceray(1, ray) without intersecting the ray a second time
+		return (x, y), self.shade(1, hpd).items(), self.indexof[id(hpd.object)]
+
+	def compute_batch(self, xs, ys) -> tuple:
+		# batched counterpart of compute: all given pixels are intersected and shaded in bulk,
+		# (N, 3) radiance and (N,) object indices
+		colors = zeros((len(xs), 3))
+		indices = full(len(xs), -1)
+		if 1 < self.maxlevel:
+			origins, directions = self.calcrays(xs, ys)
+			distances, indices = self.intersect_batch(origins, directions)
+			hit = (indices >= 0).nonzero()[0]
+			colors[hit] = self.shade_batch(1, origins[hit], directions[hit], distances[hit], indices[hit])
+		return colors, indices
+
+	def shade_batch(self, level: int, origins, directions, distances, indices) -> ndarray:
+		# shade for a batch of hits, (N, 3) radiance; reflected rays go one level down together
+		counters = self.counters["shade"]
+		points = origins + directions * distances[:, None]
+		normals = self.normals_batch(points, indices)
+		rows = self.materialtable.rows(indices, points)
+
+		colors, lit = self.lighting_batch(points, normals, directions, rows, indices)
+		lit = lit.nonzero()[0]
+
+		if level + 1 >= self.maxlevel:  # intersect would not trace them anyway
+			return colors
+		counters["shadowed"] += len(points) - len(lit)
+
+		# weight the reflected rays would have in the pixel
+		if self.reflection ** level < self.rthreshold:
+			counters["negligible"] += len(lit)
+			return colors
+
+		counters["reflections"] += len(lit)
+		# HitPointData.reflected, normalized once more by Ray
+		reflected = normalized(normalized(reflect(directions[lit], normals[lit])))
+		distances, hits = self.intersect_batch(points[lit], reflected, level + 1)
+		reflectcolors = zeros((len(lit), 3))
+		on = (hits >= 0).nonzero()[0]
+		reflectcolors[on] = self.shade_batch(level + 1, points[lit][on], reflected[on], distances[on], hits[on])
+		colors[lit] = colors[lit] + self.reflection * reflectcolors
+		return colors
+
+	def lighting_batch(self, points, normals, directions, rows, indices) -> tuple:
+		# com_lighting for a batch of hits: (N, 3) radiance and (N,) whether any light reaches them
+		colors, lit = empty((len(points), 3)), empty(len(points), dtype=bool)
+		for chunk, pairs in self.lightpairs(points, normals, directions, rows, indices):
+			colors[chunk], lit[chunk] = self.directlight(rows[chunk], *pairs)
+		return colors, lit
+
+	def lightpairs(self, points, normals, directions, rows, indices):
+		# com_lightsamples and their shadow rays for a batch of hits, in chunks small enough to keep all
+		# (hit, light) pairs of one in memory; yields (chunk, (hits, lights, intensities, levels, weights, occluded))
+		step = max(1, _PAIRS // self.lightset.widest)
+		for start in range(0, len(points), step):
+			chunk = slice(start, start + step)
+			points_, normals_, directions_, rows_ = points[chunk], normals[chunk], directions[chunk], rows[chunk]
+			hits, lights, intensities, weights = self.lightset.draws(points_)
+			levels = phonglevels(self.materialtable, rows_[hits], points_[hits], normals_[hits], directions_[hits],
+								 self.lightset.origins[lights], intensities)
+			occluded = self.occluded_batch(points_[hits], indices[chunk][hits], lights)
+			yield chunk, (hits, lights, intensities, levels, weights, occluded)
+
+	def directlight(self, rows, hits, lights, intensities, levels, weights, occluded) -> tuple:
+		# the light pairs of every hit summed up in their order, like com_lighting; (N, 3) radiance, (N,) lit
+		colors, lit = zeros((len(rows), 3)), zeros(len(rows), dtype=bool)
+		if not len(hits):
+			return colors, lit
+
+		reached = (~occluded).nonzero()[0]
+		parts = self.materialtable.colors[rows[hits]] * levels[:, None]
+		parts[occluded] = shadowed(self.materialtable, rows[hits[occluded]]) * (
+				intensities[occluded] / self.lightset.total)[:, None]
+		if self.lightsamples:
+			parts = parts * weights[:, None]
+
+		slots = arange(len(hits)) - searchsorted(hits, hits)  # position of the pair among those of its hit
+		for slot in range(int(slots.max()) + 1):
+			on = (slots == slot).nonzero()[0]
+			colors[hits[on]] = colors[hits[on]] + parts[on]
+		lit[hits[reached]] = True
+		return colors, lit
+
+	def relightframe(self):
+		# the render pass from the G-buffer: the hits come from the file if the camera, the light's
+		# position and the geometry are the same as when it was made, only the shading is done anew
+		xs, ys = tilepixels((0, 0, self.resW, self.resH))
+		key = geometrykey(self.camera, self.lightset, self.objects, (self.resW, self.resH), self.maxlevel)
+
+		loading = perf_counter()
+		gbuffer = GBuffer.load(self.relight, key)
+		found = gbuffer is not None
+		if not found:
+			gbuffer = self.gather(xs, ys, key)
+			gbuffer.save(self.relight)
+		self.timings["gbuffer"] = perf_counter() - loading
+
+		colors, indices = self.shadegbuffer(gbuffer)
+		self.framebuffer.putarrays(xs, ys, colors, indices)
+		print("> relight: {} {} {}".format(gbuffer, "from" if found else "saved to", self.relight))
+
+	def gather(self, xs, ys, key: str) -> GBuffer:
+		# the geometry half of compute_batch and shade_batch: every level of hits down to maxlevel
+		# and the lights that reach them, without shading; reflections of hits no light reaches
+		# are not traced, as there
+		levels = []
+		if 1 < self.maxlevel:
+			origins, directions = self.calcrays(xs, ys)
+			distances, indices = self.intersect_batch(origins, directions)
+			parents, level = arange(len(xs)), 1
+			while True:
+				hit = (indices >= 0).nonzero()[0]
+				origins, directions, distances, indices, parents = (
+					origins[hit], directions[hit], distances[hit], indices[hit], parents[hit])
+				points = origins + directions * distances[:, None]
+				normals = self.normals_batch(points, indices)
+				rows = self.materialtable.rows(indices, points)
+				pairhit, pairlight, pairoccluded = [zeros(0, dtype=int)], [zeros(0, dtype=int)], [zeros(0, dtype=bool)]
+				for chunk, (hits, lights, _, _, _, occluded) in self.lightpairs(points, normals, directions, rows, indices):
+					pairhit.append(hits + chunk.start)
+					pairlight.append(lights)
+					pairoccluded.append(occluded)
+				pairhit, pairlight, pairoccluded = concatenate(pairhit), concatenate(pairlight), concatenate(pairoccluded)
+				levels.append({"parent": parents, "index": indices, "points": points, "normals": normals,
+							   "directions": directions, "pairhit": pairhit, "pairlight": pairlight,
+							   "pairoccluded": pairoccluded})
+				if level + 1 >= self.maxlevel or not len(points):
+					break
+
+				lit = unique(pairhit[~pairoccluded])
+				origins, directions = points[lit], normalized(normalized(reflect(directions[lit], normals[lit])))
+				distances, indices = self.intersect_batch(origins, directions, level + 1)
+				parents, level = lit, level + 1
+		return GBuffer(key, len(xs), levels)
+
+	def shadegbuffer(self, gbuffer: GBuffer) -> tuple:
+		# shade_batch over the stored levels, deepest first; (P, 3) radiance and (P,) object index per pixel
+		depth, negligible = len(gbuffer.levels), False
+		for level in range(1, depth + 1):
+			if level + 1 < self.maxlevel and self.reflection ** level < self.rthreshold:
+				depth, negligible = level, True  # the levels below are not shaded
+				break
+
+		counters = self.counters["shade"]
+		below = None
+		for level in range(depth, 0, -1):
+			hits = gbuffer.levels[level - 1]
+			points, pairhit, pairlight = hits["points"], hits["pairhit"], hits["pairlight"]
+			rows = self.materialtable.rows(hits["index"], points)
+			intensities = self.lightset.intensities_at(points[pairhit], pairlight)
+			levels = phonglevels(self.materialtable, rows[pairhit], points[pairhit], hits["normals"][pairhit],
+								 hits["directions"][pairhit], self.lightset.origins[pairlight], intensities)
+			colors, lit = self.directlight(rows, pairhit, pairlight, intensities, levels, None, hits["pairoccluded"])
+			lit = lit.nonzero()[0]
+
+			if level + 1 < self.maxlevel:
+				counters["shadowed"] += len(rows) - len(lit)
+				if level == depth and negligible:
+					counters["negligible"] += len(lit)
+				else:
+					counters["reflections"] += len(lit)
+					reflectcolors = zeros((len(rows), 3))
+					reflectcolors[gbuffer.levels[level]["parent"]] = below
+					colors[lit] = colors[lit] + self.reflection * reflectcolors[lit]
+			below = colors
+
+		pixels = zeros((gbuffer.pixels, 3))
+		indices = full(gbuffer.pixels, -1)
+		if depth:
+			primary = gbuffer.levels[0]
+			pixels[primary["parent"]] = below
+			indices[primary["parent"]] = primary["index"]
+		return pixels, indices
+
+	def normals_batch(self, points, indices) -> ndarray:
+		normals = empty(points.shape)
+		for idx in unique(indices).tolist():
+			on = (indices == idx).nonzero()[0]
+			normals[on] = self.objects[idx].normalsat(points[on])
+		return normals
+
+	def occluded_batch(self, points, indices, lights) -> ndarray:
+		# objectbetween for a batch of hits on the objects indices and the lights, (N,) bool
+		tolight = self.lightset.origins[lights] - points
+		lightdists = sqrt(rowdot(tolight, tolight))
+		directions = normalized(tolight)
+
+		# as in objectbetween, a hit on a mesh tests the mesh as well
+		skip = indices.copy()
+		for idx, obj in enumerate(self.objects):
+			if isinstance(obj, TriangleMesh):
+				skip[indices == idx] = -1
+
+		if self.bvh:
+			occluded = self.bvh.occluded_batch(points, directions, self.__mindist, lightdists, skip)
+		else:
+			occluded = zeros(len(points), dtype=bool)
+			for idx, obj in enumerate(self.objects):
+				rays = ((skip != idx) & ~occluded).nonzero()[0]
+				dists = obj.intersectionparameters(points[rays], directions[rays])
+				occluded[rays[(self.__mindist < dists) & (dists < lightdists[rays])]] = True
 
-		color = self.traceray(1, ray)
-		self.pixels.append(((x, y), color.items()))
-		return (x, y), color.items()
+		counters = self.counters["shadow"]
+		counters["rays"] += len(points)
+		counters["occluded"] += int(occluded.sum())
+		return occluded
 
 	def __str__(self):
 		lst = [
 			self.camera,
 			self.multi,
-			self.light,
+			self.lights,
 			self.objects,
 			[self.resW, self.resH],
 			self.objects,
@@ -160,15 +765,20 @@ class RayTracer:
 
 	# DONE
 	def __init__(self, camera: Camera, multi=0, light=None,
-				 objects=[], res=(200, 200), maxlevel=5, reflection=1.0, export=False):
-		# ShareManager.register('SharedData', self)
-		self.pixels = []
+				 objects=[], res=(200, 200), maxlevel=5, reflection=1.0, export=False, batched=False,
+				 tilesize=16, accelerate=False, tonemap=clamp, rthreshold=.0, progressive=0,
+				 antialias=False, aathreshold=24, aasamples=5, show=True, instrument=False, renderlog=None,
+				 ftype="jpeg", stream=False, checkpoint=None, resume=False, coordinator=None, localworkers=0, pool=None,
+				 animation=None, relight=None, lights=None, lightcutoff=.01, lightsamples=0):
+		self.framebuffer = None
 		self.camera = camera
 		if multi and multi >= 2:
 			self.multi = multi
 		else:
 			self.multi = False
-		self.light = light
+		self.lightcutoff = lightcutoff
+		self.lightsamples = lightsamples
+		self.setlights(list(lights) if lights else [light])
 		self.objects = objects
 		self.resW, self.resH = res
 		self.pxWidth = self.camera.width / (self.resW - 1)
@@ -176,8 +786,63 @@ class RayTracer:
 		self.image = None
 		self.maxlevel = maxlevel
 		self.reflection = reflection
+		self.rthreshold = rthreshold
+		self.progressive = progressive
+		self.directory = "./renders/"
+		self.filename = "render"
 		self.__mindist = .0001
 		self._export = export
+		self.show = show
+		self.renderlog = renderlog
+		self.ftype = ftype.lower()
+		self.format = imageformat(self.ftype)  # of PIL, unknown types fail before rendering
+		self.stream = stream
+		self.writer = None
+		if stream and (progressive or antialias):
+			raise ValueError("a streamed render goes band by band, without -progressive or -aa")
+		self.checkpointfile = checkpoint or (self.directory + "checkpoint.raw" if resume else None)
+		self.checkpoint = None
+		self.resume = resume
+		self.coordinator = coordinator
+		self.localworkers = localworkers
+		self.pool = pool  # a started Coordinator that outlives this render, see raytracer.server
+		if coordinator or pool:
+			self.multi = False  # the workers are elsewhere
+		if stream and self.checkpointfile:
+			raise ValueError("a streamed render keeps no frame to checkpoint")
+		self.animation = animation
+		self.frame = None  # of the animation the camera and light are at
+		if animation and (stream or self.checkpointfile or pool):
+			raise ValueError("an animation renders whole frames, without -stream, -checkpoint or a render server")
+		self.relight = relight  # G-buffer file, see relightframe
+		if relight and (stream or self.checkpointfile or animation):
+			raise ValueError("-relight shades one whole frame from its G-buffer, without -stream, -checkpoint or -animate")
+		if relight and lightsamples:
+			raise ValueError("-relight shades every light that reaches a hit, not with -lightsamples")
+		if stream and self.ftype not in WRITERS:
+			raise ValueError("only {} can be streamed, not {}".format(" and ".join(WRITERS), ftype))
+		self.batched = batched
+		self.tilesize = tilesize
+		self.scheduler = None
+		self.accelerate = accelerate
+		self.tonemap = tonemap
+		self.lastoccluder = None
+		self.counters = {
+			"shadow": {"rays": 0, "occluded": 0, "cachetests": 0, "cachehits": 0},
+			"shade": {"reflections": 0, "shadowed": 0, "negligible": 0},
+		}
+		self.timings = {}
+		self.instrument = instrument
+		self.instruments = None
+		self.bvh = None
+		self.indexof = {}
+		self.materialtable = None
+		self.antialias = antialias
+		self.aathreshold = aathreshold
+		self.aasamples = aasamples
+		self.refined = 0
+		if animation:
+			self.setframe(0)
 
 	# DONE
 	def traceray(self, level: int, ray: Ray):
@@ -185,7 +850,7 @@ class RayTracer:
 
 		if hitPointData:
 			return self.shade(level, hitPointData)
-		return black
+		return Radiance()
 
 	# DONE
 	def calcray(self, x: int, y: int):
@@ -193,11 +858,25 @@ class RayTracer:
 		ycomp = self.camera.u.scale(y * self.pxHeigth - self.camera.height / 2)
 		return Ray(self.camera.origin, self.camera.f + xcomp + ycomp)
 
+	def calcrays(self, xs, ys):
+		# (N, 3) origins and normalized directions for the pixels xs, ys
+		xcomp = outer(xs * self.pxWidth - self.camera.width / 2, self.camera.s.xyz)
+		ycomp = outer(ys * self.pxHeigth - self.camera.height / 2, self.camera.u.xyz)
+		directions = self.camera.f.xyz + xcomp + ycomp
+		directions = directions / sqrt(rowdot(directions, directions))[:, None]
+		origins = full(directions.shape, self.camera.origin.xyz, dtype=float)
+		return origins, directions
+
 	# DONE
 	def intersect(self, level: int, ray: Ray):
 		if level >= self.maxlevel:  # if not intersection has been found after depth of maxlevel
 			return None
 
+		if self.bvh:
+			object, maxdist = self.bvh.intersect(ray, self.__mindist)
+			if not object: return None
+			return HitPointData(object=object, ray=ray, distance=maxdist)
+
 		maxdist = float("inf")
 		object = None
 		for obj in self.objects:
@@ -214,29 +893,123 @@ class RayTracer:
 
 		return HitPointData(object=object, ray=ray, distance=maxdist)
 
-	# DONE
-	def objectbetween(self, hpd: HitPointData):
-		for obj in self.objects:
-			if obj == hpd.object:
-				continue
+	def intersect_batch(self, origins, directions, level=1):
+		# nearest hit for every ray of the level; returns distances and object indices (-1 on miss)
+		if self.bvh:
+			return self.bvh.intersect_batch(origins, directions, self.__mindist)
 
-			ray_tolight = Ray(hpd.intersection, self.light.origin - hpd.intersection)
-			dist = obj.intersectionparameter(ray_tolight)
-			if dist and dist > self.__mindist:
+		maxdist = full(len(origins), inf)
+		indices = full(len(origins), -1)
+		for idx, obj in enumerate(self.objects):
+			hitdist = obj.intersectionparameters(origins, directions)
+			closer = (self.__mindist < hitdist) & (hitdist < maxdist)
+			maxdist[closer] = hitdist[closer]
+			indices[closer] = idx
+		return maxdist, indices
+
+	# DONE
+	def objectbetween(self, hpd: HitPointData, light=None):
+		# any object between the hit point and the light; hits behind the light do not count
+		tolight = hpd.intersection.vectorto((light or self.light).origin)
+		lightdist = tolight.length()
+		ray_tolight = Ray(hpd.intersection, tolight)
+
+		counters = self.counters["shadow"]
+		counters["rays"] += 1
+
+		# a mesh may shadow itself, its faces keep clear of the point by the mesh's _EPS
+		skip = None if isinstance(hpd.object, TriangleMesh) else hpd.object
+
+		# neighbouring pixels are mostly shadowed by the same object, so it goes first
+		last = self.lastoccluder
+		if last is not None and last is not skip:
+			counters["cachetests"] += 1
+			dist = last.intersectionparameter(ray_tolight)
+			if dist and self.__mindist < dist < lightdist:
+				counters["cachehits"] += 1
+				counters["occluded"] += 1
 				return True
-		return False
+
+		if self.bvh:
+			occluder = self.bvh.occluder(ray_tolight, self.__mindist, lightdist, skip=skip)
+		else:
+			occluder = None
+			for obj in self.objects:
+				if obj is skip:
+					continue
+
+				dist = obj.intersectionparameter(ray_tolight)
+				if dist and self.__mindist < dist < lightdist:
+					occluder = obj
+					break
+
+		if occluder is None:
+			return False
+
+		self.lastoccluder = occluder
+		counters["occluded"] += 1
+		return True
+
+	def shadowreport(self) -> str:
+		counters = self.counters["shadow"]
+		tests = counters["cachetests"]
+		report = "> shadow: {} rays, {} occluded, occluder cache hit {} of {} ({:.1f}%)".format(
+				counters["rays"], counters["occluded"], counters["cachehits"], tests,
+				100. * counters["cachehits"] / tests if tests else .0)
+		if len(self.lights) > 1:
+			report += "\n> lights: {}".format(self.lightset)
+		return report
 
 	# DONE
-	def shade(self, level: int, hpd: HitPointData) -> Color:
-		directcolor = self.com_directlight(hpd)
+	def shade(self, level: int, hpd: HitPointData) -> Radiance:
+		counters = self.counters["shade"]
+		directcolor, lit = self.com_lighting(hpd)
+		if not lit:
+			if level + 1 < self.maxlevel:
+				counters["shadowed"] += 1
+			return directcolor
+
+		if level + 1 >= self.maxlevel:  # intersect would not trace it anyway
+			return directcolor
+
+		# weight the reflected ray would have in the pixel
+		if self.reflection ** level < self.rthreshold:
+			counters["negligible"] += 1
+			return directcolor
+
+		counters["reflections"] += 1
 		reflectedray = Ray(hpd.intersection, hpd.reflected)
 		reflectcolor = self.traceray(level + 1, reflectedray)
-
-		if self.objectbetween(hpd):
-			return self.com_shadedcolor(hpd)
-
 		return directcolor + self.reflection * reflectcolor
 
+	def shadereport(self) -> str:
+		counters = self.counters["shade"]
+		return "> reflection: {} rays traced, {} saved ({} from shadowed points, {} below -rthreshold)".format(
+				counters["reflections"], counters["shadowed"] + counters["negligible"],
+				counters["shadowed"], counters["negligible"])
+
+	def com_lightsamples(self, hpd: HitPointData) -> list:
+		# [(light, intensity at the hit, weight)] to shade the hit with: the lights that reach it
+		# or, with -lightsamples, that many drawn from those of its cell
+		return self.lightset.draw(hpd.intersection)
+
+	def com_lighting(self, hpd: HitPointData) -> tuple:
+		# (radiance, lit) of the direct light at the hit, summed over its light samples in order: the
+		# Phong color of those that reach it, the shadowed color by the share of the light of the
+		# others. lit if any light reaches it; with one light this is com_directlight or com_shadedcolor
+		color, lit = None, False
+		for idx, intensity, weight in self.com_lightsamples(hpd):
+			light = self.lights[idx]
+			if self.objectbetween(hpd, light):
+				part = self.com_shadedcolor(hpd) * (intensity / self.lightset.total)
+			else:
+				part = self.com_directlight(hpd, light, intensity)
+				lit = True
+			if weight != 1.:
+				part = part * weight
+			color = part if color is None else color + part
+		return color or Radiance(), lit
+
 	# DONE
 	def com_shadedcolor(self, hpd: HitPointData):
 		intersection = hpd.intersection
@@ -244,10 +1017,11 @@ class RayTracer:
 		return object.material.calccolor(p=intersection, shaded=True)
 
 	# DONE
-	def com_directlight(self, hpd: HitPointData) -> Color:
+	def com_directlight(self, hpd: HitPointData, light=None, intensity=None) -> Radiance:
 		ray, object, distance, intersection, normal, reflected = hpd.data()
+		light = light or self.light
 
-		tolight = intersection.vectorto(self.light.origin).normalized()
+		tolight = intersection.vectorto(light.origin).normalized()
 		tolight_r = tolight.reflect(normal).normalized()
 		d = ray.direction
 
@@ -260,26 +1034,22 @@ class RayTracer:
 		return object.material.calccolor(
 				phi=phi,
 				theta=theta,
-				intensity=self.light.intensity,
+				intensity=light.intensity if intensity is None else intensity,
 				p=intersection)
 
 
-if __name__ == '__main__':
-	argsHandler = ArgsHandler(argv=argv)
-
-	print(argsHandler.isShow())
-
+def builtinscene(argsHandler: ArgsHandler, res: list) -> tuple:
+	# (camera, lights, objects) of the demo scene, scenes/demo.json with the default arguments
 	up = Vector(0, -1, 0)
 	fov = 20
 	radius = 30
 	side = radius + 20
 	z = 100
 	top = 70
-	_res = argsHandler.getRes()
 	plane_y = Vector(0, 0, (radius + 10))
 
 	focus = Vector(0, 35, z)
-	camera = Camera(Vector(0, 45, -75), up, focus, fov, res=_res)
+	camera = Camera(Vector(0, 45, -75), up, focus, fov, res=res)
 	light = Light(Vector(argsHandler.getLightPos()),
 				  argsHandler.getLightColor(),
 				  intensity=argsHandler.getLightIntensity())
@@ -295,17 +1065,88 @@ if __name__ == '__main__':
 		Plane(Vector(0, -40, 0), up * -1, materialsContainer[argsHandler.getFloorMaterial()]),
 		Triangle(sp0.center + plane_y, sp1.center + plane_y, sp2.center + plane_y, material=yellow_mat),
 	]
+	return camera, [light], objects
+
 
-	rt = RayTracer(
+def demoscene(argsHandler: ArgsHandler, view=None) -> RayTracer:
+	# three spheres, a triangle and a floor set up from the command line, or the scene of -scene;
+	# view may move the camera: {"origin": (x, y, z), "focus": ..., "up": ..., "fov": ...}
+	_res = argsHandler.getRes()
+
+	if argsHandler.getScene():
+		scene = SceneFile(argsHandler.getScene())
+		loading = perf_counter()
+		camera, lights, objects = scene.load(_res)
+		print("> scene {}: {} objects {} in {:.3f}s".format(
+				scene.fname, len(objects), "from the cache" if scene.cached else "compiled", perf_counter() - loading))
+	else:
+		camera, lights, objects = builtinscene(argsHandler, _res)
+
+	if view:
+		camera = Camera(Vector(view.get("origin", camera.origin)), Vector(view.get("up", -1 * camera.up)),
+						Vector(view.get("focus", camera.focus)), view.get("fov", camera.fov), res=_res)
+
+	if argsHandler.getMesh():
+		objects.append(TriangleMesh.load(argsHandler.getMesh(), material=grey_mat))
+
+	animation = None
+	if argsHandler.getAnimation() == "turntable":
+		animation = Animation.turntable(argsHandler.getFrames() or 36, camera, lights[0])
+	elif argsHandler.getAnimation():
+		animation = Animation.load(argsHandler.getAnimation(), camera, lights[0], frames=argsHandler.getFrames())
+
+	return RayTracer(
 			camera=camera,
-			light=light,
+			lights=lights,
 			objects=objects,
 			res=_res,
 			reflection=argsHandler.getReflection(),
 			maxlevel=argsHandler.getRecursiveDepth(),
+			rthreshold=argsHandler.getReflectionThreshold(),
+			progressive=argsHandler.getProgressive(),
 			multi=argsHandler.getProcesses(),
 			export=argsHandler.isExport(),
+			batched=argsHandler.isBatched(),
+			tilesize=argsHandler.getTileSize(),
+			accelerate=argsHandler.isBVH(),
+			tonemap=tonemaps[argsHandler.getToneMap()],
+			antialias=argsHandler.isAntialiased(),
+			aathreshold=argsHandler.getAAThreshold(),
+			aasamples=argsHandler.getAASamples(),
+			show=not argsHandler.isShow(),
+			instrument=argsHandler.isInstrumented(),
+			renderlog=argsHandler.getRenderLog(),
+			ftype=argsHandler.getFType() or "jpeg",
+			stream=argsHandler.isStreamed(),
+			checkpoint=argsHandler.getCheckpoint(),
+			resume=argsHandler.isResumed(),
+			coordinator=argsHandler.getCoordinator(),
+			localworkers=argsHandler.getLocalWorkers(),
+			animation=animation,
+			relight=argsHandler.getRelight(),
+			lightcutoff=argsHandler.getLightCutoff(),
+			lightsamples=argsHandler.getLightSamples(),
 			# dirOut=argsHandler.getDirOut(),
 	)
 
-	rt.start()
+
+if __name__ == '__main__':
+	argsHandler = ArgsHandler(argv=argv)
+	if argsHandler.getWorker():
+		work(parseaddress(argsHandler.getWorker()), RayTracer.fromsettings, name=gethostname())
+	elif argsHandler.getServe():
+		server = RenderServer(parseaddress(argsHandler.getServe(), port=7700),
+							  lambda args, view: demoscene(ArgsHandler(argv=argv + args), view),
+							  RayTracer.fromsettings, processes=argsHandler.getProcesses() or 4,
+							  tilesize=argsHandler.getTileSize())
+		print("> {} waiting for jobs".format(server))
+		try:
+			server.serve_forever()
+		finally:
+			server.server_close()
+	else:
+		tracer = demoscene(argsHandler)
+		if tracer.animation:
+			tracer.animate()
+		else:
+			tracer.start()
@@ -0,0 +1,59 @@
+import signal
+import subprocess
+import sys
+import time
+from os import killpg, path
+
+import pytest
+
+RENDER = path.join(path.dirname(path.dirname(path.abspath(__file__))), "render.py")
+ARGS = ["-res=240,180", "-tilesize=8", "-noshow", "-export", "-ftype=png", "-checkpoint=cp/frame.raw"]
+
+
+def render(cwd, *args) -> str:
+	# stdout of a render of the demo scene run to the end in cwd
+	done = subprocess.run([sys.executable, RENDER] + ARGS + list(args), cwd=cwd, capture_output=True, text=True)
+	assert done.returncode == 0, done.stderr
+	return done.stdout
+
+
+def image(cwd) -> bytes:
+	pngs = sorted((cwd / "renders").glob("*.png"))
+	assert len(pngs) == 1, pngs
+	return pngs[0].read_bytes()
+
+
+def killafter(cwd, tiles: int, *args):
+	# starts a render in cwd and SIGKILLs it, workers included, once tiles are marked done
+	marked = cwd / "cp" / "frame.raw.tiles"
+	process = subprocess.Popen([sys.executable, RENDER] + ARGS + list(args), cwd=cwd, start_new_session=True,
+							   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	try:
+		deadline = time.monotonic() + 60
+		while time.monotonic() < deadline and process.poll() is None:
+			if marked.is_file() and marked.read_text().count(";\n") >= tiles:
+				break
+			time.sleep(.002)
+		assert process.poll() is None, "the render finished before it could be killed"
+	finally:
+		killpg(process.pid, signal.SIGKILL)
+		process.wait()
+
+
+@pytest.mark.parametrize("processes", ["-processes=0", "-processes=3"])
+def test_resumed_render_is_identical(tmp_path, processes):
+	whole, killed = tmp_path / "whole", tmp_path / "killed"
+	whole.mkdir()
+	killed.mkdir()
+	render(whole, processes)
+
+	killafter(killed, 4, processes)
+	assert (killed / "cp" / "frame.raw").is_file()
+	assert not (killed / "renders").is_dir() or not list((killed / "renders").glob("*.png"))
+
+	report = render(killed, processes, "-resume")
+	done = int(report.split("> checkpoint ")[1].split(": ")[1].split(" tiles")[0])
+	assert done >= 4
+	assert image(killed) == image(whole)
+	assert not (killed / "cp" / "frame.raw").exists()
+	assert not (killed / "cp" / "frame.raw.tiles").exists()
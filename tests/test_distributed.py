@@ -0,0 +1,72 @@
+import socket
+import subprocess
+import sys
+import time
+from os import path
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from raytracer.distributed import recvmessage, sendmessage  # noqa: E402
+
+RENDER = path.join(ROOT, "render.py")
+ARGS = ["-res=120,90", "-tilesize=16", "-noshow", "-export", "-ftype=png"]
+
+
+def render(cwd, *args) -> subprocess.CompletedProcess:
+	return subprocess.run([sys.executable, RENDER] + ARGS + list(args), cwd=cwd, capture_output=True, text=True,
+						  timeout=120)
+
+
+def image(cwd) -> bytes:
+	pngs = sorted((cwd / "renders").glob("*.png"))
+	assert len(pngs) == 1, pngs
+	return pngs[0].read_bytes()
+
+
+def freeport() -> int:
+	with socket.socket() as probe:
+		probe.bind(("127.0.0.1", 0))
+		return probe.getsockname()[1]
+
+
+def test_local_workers_give_the_single_process_image(tmp_path):
+	single, workers = tmp_path / "single", tmp_path / "workers"
+	single.mkdir()
+	workers.mkdir()
+	done = render(single, "-processes=0")
+	assert done.returncode == 0, done.stderr
+	done = render(workers, "-coordinator=127.0.0.1:0", "-localworkers=2")
+	assert done.returncode == 0, done.stderr
+	assert image(workers) == image(single)
+
+
+def test_tile_lost_too_often_fails_the_render(tmp_path):
+	# a worker that drops its connection as soon as it gets a tile, over and over
+	port = freeport()
+	process = subprocess.Popen([sys.executable, RENDER] + ARGS + ["-res=32,32", "-coordinator=127.0.0.1:{}".format(port)],
+							   cwd=tmp_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+	try:
+		deadline, dropped = time.monotonic() + 60, 0
+		while process.poll() is None and time.monotonic() < deadline:
+			try:
+				conn = socket.create_connection(("127.0.0.1", port), timeout=5)
+			except OSError:
+				time.sleep(.05)
+				continue
+			with conn:
+				try:
+					sendmessage(conn, ("hello", "flaky"))
+					while recvmessage(conn)[0] != "tile":
+						pass
+					dropped += 1
+				except (OSError, EOFError):
+					pass
+		_, stderr = process.communicate(timeout=60)
+	finally:
+		process.kill()
+
+	assert process.returncode != 0
+	assert "was lost with 4 workers" in stderr
+	assert dropped >= 4
+	assert not (tmp_path / "renders").is_dir() or not list((tmp_path / "renders").glob("*.png"))